@@ -0,0 +1,136 @@
+# app/adaptive.py
+
+import collections
+import threading
+import time
+
+# --- Параметры адаптивного управления нагрузкой ---
+ADAPTIVE_WINDOW_SECONDS = 2.0   # Длительность окна измерений
+ADAPTIVE_RECOVER_WINDOWS = 3    # Сколько спокойных окон подряд нужно, чтобы повысить качество
+ADAPTIVE_FPS_TOLERANCE = 0.9    # Перегрузка, если FPS ниже цели больше чем на 10%
+ADAPTIVE_HEADROOM = 0.6         # Запас: задержка ниже 60% бюджета
+ADAPTIVE_HISTORY_SIZE = 20      # Сколько последних решений хранить для API
+
+# Уровни деградации: чем выше уровень, тем меньше нагрузка.
+# frame_stride - обрабатывается каждый N-й кадр, frame_scale - доля базовой ширины обработки,
+# yolo_min_gap_frames - минимум обработанных кадров между запусками YOLO
+DEFAULT_LEVELS = (
+    {'frame_stride': 1, 'frame_scale': 1.0, 'yolo_min_gap_frames': 0},
+    {'frame_stride': 1, 'frame_scale': 1.0, 'yolo_min_gap_frames': 3},
+    {'frame_stride': 1, 'frame_scale': 0.85, 'yolo_min_gap_frames': 5},
+    {'frame_stride': 2, 'frame_scale': 0.85, 'yolo_min_gap_frames': 5},
+    {'frame_stride': 2, 'frame_scale': 0.75, 'yolo_min_gap_frames': 10},
+    {'frame_stride': 3, 'frame_scale': 0.65, 'yolo_min_gap_frames': 15},
+)
+
+
+class AdaptiveController:
+    """
+    Регулятор нагрузки конвейера камеры.
+    По замерам задержки кадров (от захвата до публикации), задержки детекций (от захвата
+    до результата YOLO) и фактическому FPS раз в окно
+    решает, перейти ли на более легкий уровень (шаг кадров, разрешение, частота YOLO)
+    или вернуться к более качественному, когда появился запас.
+    Текущие настройки читаются стадиями конвейера на каждом кадре.
+    """
+
+    def __init__(self, target_fps, latency_budget_seconds, source_fps=None, levels=DEFAULT_LEVELS,
+                 window_seconds=ADAPTIVE_WINDOW_SECONDS, recover_windows=ADAPTIVE_RECOVER_WINDOWS):
+        """
+        :param target_fps: Целевая частота обработанных кадров.
+        :param latency_budget_seconds: Бюджет средней задержки от захвата до публикации и до результата YOLO.
+        :param source_fps: Частота кадров источника (ограничивает достижимый FPS при шаге кадров).
+        :param levels: Уровни деградации от лучшего качества к самой легкой нагрузке.
+        """
+        self.target_fps = target_fps
+        self.latency_budget_seconds = latency_budget_seconds
+        self.source_fps = source_fps
+        self.levels = levels
+        self.window_seconds = window_seconds
+        self.recover_windows = recover_windows
+
+        self.level = 0
+        self.settings = dict(levels[0])
+        self.history = collections.deque(maxlen=ADAPTIVE_HISTORY_SIZE)
+        self.last_measurement = None
+
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._frames = 0
+        self._latency_sum = 0.0
+        self._detections = 0
+        self._detection_latency_sum = 0.0
+        self._calm_windows = 0
+
+    def observe(self, latency_seconds):
+        """Учитывает опубликованный кадр. Вызывается стадией публикации на каждом кадре."""
+        with self._lock:
+            self._frames += 1
+            self._latency_sum += latency_seconds
+            now = time.monotonic()
+            if now - self._window_start >= self.window_seconds:
+                self._evaluate(now)
+
+    def observe_detection(self, latency_seconds):
+        """Учитывает результат YOLO. Вызывается стадией инференса."""
+        with self._lock:
+            self._detections += 1
+            self._detection_latency_sum += latency_seconds
+
+    def _evaluate(self, now):
+        elapsed = now - self._window_start
+        fps = self._frames / elapsed
+        frame_latency = self._latency_sum / self._frames if self._frames else 0.0
+        detection_latency = self._detection_latency_sum / self._detections if self._detections else 0.0
+        latency = max(frame_latency, detection_latency)
+        self._window_start = now
+        self._frames = 0
+        self._latency_sum = 0.0
+        self._detections = 0
+        self._detection_latency_sum = 0.0
+
+        # При шаге кадров N обработать можно не больше source_fps / N кадров в секунду
+        target_fps = self.target_fps
+        if self.source_fps:
+            target_fps = min(target_fps, self.source_fps / self.settings['frame_stride'])
+
+        self.last_measurement = {'fps': round(fps, 2), 'target_fps': round(target_fps, 2),
+                                 'frame_latency_seconds': round(frame_latency, 4),
+                                 'detection_latency_seconds': round(detection_latency, 4)}
+
+        if latency > self.latency_budget_seconds:
+            self._calm_windows = 0
+            self._set_level(self.level + 1, f"задержка {latency:.3f} с > бюджета {self.latency_budget_seconds} с")
+        elif fps < target_fps * ADAPTIVE_FPS_TOLERANCE:
+            self._calm_windows = 0
+            self._set_level(self.level + 1, f"FPS {fps:.1f} < цели {target_fps:.1f}")
+        elif latency < self.latency_budget_seconds * ADAPTIVE_HEADROOM:
+            self._calm_windows += 1
+            if self._calm_windows >= self.recover_windows:
+                self._calm_windows = 0
+                self._set_level(self.level - 1, f"запас: задержка {latency:.3f} с, FPS {fps:.1f}")
+        else:
+            self._calm_windows = 0
+
+    def _set_level(self, level, reason):
+        level = max(0, min(len(self.levels) - 1, level))
+        if level == self.level:
+            return
+        direction = "снижение нагрузки" if level > self.level else "повышение качества"
+        self.level = level
+        self.settings = dict(self.levels[level])
+        self.history.append({'time': time.time(), 'level': level, 'settings': dict(self.settings), 'reason': reason})
+        print(f"[Adaptive] {direction}: уровень {level} {self.settings} ({reason})")
+
+    def status(self):
+        """Текущее состояние регулятора для API."""
+        with self._lock:
+            return {
+                'level': self.level,
+                'max_level': len(self.levels) - 1,
+                'settings': dict(self.settings),
+                'target_fps': self.target_fps,
+                'latency_budget_seconds': self.latency_budget_seconds,
+                'last_measurement': self.last_measurement,
+                'history': list(self.history),
+            }
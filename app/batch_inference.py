@@ -0,0 +1,109 @@
+# app/batch_inference.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+YOLO_IMGSZ = 640 # Размер входа YOLO по умолчанию
+
+
+def parse_results(result, names):
+    """
+    Преобразует результат ultralytics для одного кадра в список детекций.
+    Детекция - кортеж (x1, y1, x2, y2, conf, name).
+    """
+    detections = []
+    for box in result.boxes:
+        x1, y1, x2, y2 = map(int, box.xyxy[0])
+        conf = round(float(box.conf[0]), 2)
+        name = names[int(box.cls[0])]
+        detections.append((x1, y1, x2, y2, conf, name))
+    return detections
+
+
+class BatchInferenceWorker:
+    """
+    Общий поток инференса YOLO для нескольких камер.
+    Камеры отправляют кадры через submit(), а поток собирает их в батч
+    (не больше max_batch_size кадров и не дольше max_wait_seconds ожидания)
+    и вызывает модель один раз на каждый размер входа в батче.
+    """
+
+    def __init__(self, model, device, max_batch_size=8, max_wait_seconds=0.02, conf=0.5):
+        """
+        :param model: Модель YOLO.
+        :param device: Устройство для инференса ('cpu' или 'cuda').
+        :param max_batch_size: Максимальное число кадров в одном батче.
+        :param max_wait_seconds: Сколько ждать добора батча после первого кадра.
+        :param conf: Порог уверенности детекций.
+        """
+        self.model = model
+        self.device = device
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max_wait_seconds
+        self.conf = conf
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.batches_processed = 0
+        self.frames_processed = 0
+
+    def start(self):
+        self._thread.start()
+        print(f"[Batch Inference] Поток инференса запущен (батч до {self.max_batch_size} кадров, ожидание {self.max_wait_seconds * 1000:.0f} мс).")
+        return self
+
+    def submit(self, frame, imgsz=YOLO_IMGSZ):
+        """
+        Ставит кадр в очередь на инференс. Возвращает Future со списком детекций.
+        :param imgsz: Размер входа YOLO (меньше для кропов областей движения).
+        """
+        future = Future()
+        self._queue.put((frame, imgsz, future))
+        return future
+
+    def infer(self, frame, imgsz=YOLO_IMGSZ):
+        """Синхронный вызов: отправляет кадр и ждет детекции."""
+        return self.submit(frame, imgsz).result()
+
+    def infer_many(self, frames, imgsz=YOLO_IMGSZ):
+        """Синхронный вызов для нескольких кадров (например, кропов): все попадают в общие батчи."""
+        futures = [self.submit(frame, imgsz) for frame in frames]
+        return [future.result() for future in futures]
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Один вызов модели на каждый размер входа: кадры камер и кропы разных размеров не смешиваются
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for imgsz, group in groups.items():
+                self._infer_group(group, imgsz)
+            self.batches_processed += 1
+            self.frames_processed += len(batch)
+
+    def _infer_group(self, group, imgsz):
+        frames = [frame for frame, _, _ in group]
+        try:
+            results = self.model(frames, conf=self.conf, verbose=False, device=self.device, imgsz=imgsz)
+            for (_, _, future), result in zip(group, results):
+                future.set_result(parse_results(result, self.model.names))
+        except Exception as e:
+            print(f"[Batch Inference ERROR] Ошибка инференса батча из {len(group)} кадров: {e}")
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
@@ -0,0 +1,232 @@
+# app/benchmark.py
+"""
+Офлайн-бенчмарк конвейера детектирования.
+
+Проигрывает один или несколько видеофайлов один раз с максимальной скоростью и без пропуска кадров,
+уведомления Telegram заменяются локальной заглушкой. Результат печатается в JSON:
+кадры/с, p50/p95/p99 задержки стадий, пиковый RSS, число запусков YOLO и объем входа YOLO
+(мегапиксели тензоров после letterbox - затраты инференса, не зависящие от железа).
+
+Примеры (из папки app):
+    python benchmark.py videos/video.mp4 --output baseline.json
+    python benchmark.py videos/video.mp4 --min-area 1500 --width 640 --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import resource
+import sys
+import time
+
+import roi
+from batch_inference import YOLO_IMGSZ
+
+STAGES = ('capture', 'mog2', 'yolo', 'publish', 'end_to_end')
+PERCENTILES = (50, 95, 99)
+
+
+class SampleRecorder:
+    """Сохраняет все замеры стадии для точного расчета перцентилей (вместо гистограммы)."""
+
+    def __init__(self):
+        self.samples = []
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+
+
+class StubOutbox:
+    """Заглушка очереди уведомлений: только считает события, без сети и диска."""
+
+    def __init__(self):
+        self.events = 0
+
+    def enqueue(self, frame, photo_path, message_text, voice_text, clip_path=None, camera=None):
+        self.events += 1
+
+
+def percentile(samples, q):
+    """Перцентиль q (0-100) по методу ближайшего ранга."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = math.ceil(q / 100.0 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize_stages(recorders):
+    """Перцентили задержек стадий в миллисекундах."""
+    summary = {}
+    for stage, recorder in recorders.items():
+        stage_summary = {'count': len(recorder.samples)}
+        for q in PERCENTILES:
+            value = percentile(recorder.samples, q)
+            stage_summary[f'p{q}_ms'] = round(value * 1000, 3) if value is not None else None
+        summary[stage] = stage_summary
+    return summary
+
+
+def peak_rss_mb():
+    # На Linux ru_maxrss в килобайтах, на macOS - в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def run_benchmark(video_paths, min_area, detection_interval, frame_width, use_tracker=True, roi_inference=False):
+    """
+    Прогоняет видеофайлы через CameraPipeline в режиме воспроизведения (realtime=False).
+    :return: Словарь с результатами в формате JSON.
+    """
+    start_import_time = time.perf_counter()
+    import detector
+    # Модель грузится лениво: ждем загрузки и прогрева, чтобы они не попали в задержки стадий
+    if not detector.yolo_model.wait_ready():
+        raise RuntimeError(f"Модель YOLO не загружена: {detector.yolo_model.error}")
+    model_load_seconds = time.perf_counter() - start_import_time
+
+    detector.DETECTION_INTERVAL_SECONDS = detection_interval
+
+    yolo_calls = [0]
+    yolo_pixels = [0]
+    def counting_infer(frame, imgsz=YOLO_IMGSZ):
+        yolo_calls[0] += 1
+        yolo_pixels[0] += roi.inference_pixels([frame.shape[:2]], imgsz)
+        return detector.detect_objects(frame, imgsz)
+
+    def counting_infer_batch(frames, imgsz=YOLO_IMGSZ):
+        yolo_calls[0] += 1
+        yolo_pixels[0] += roi.inference_pixels([frame.shape[:2] for frame in frames], imgsz)
+        return detector.detect_objects_batch(frames, imgsz)
+
+    total_recorders = {stage: SampleRecorder() for stage in STAGES}
+    videos = []
+    total_frames = 0
+    total_yolo_calls = 0
+    total_yolo_pixels = 0
+    total_seconds = 0.0
+
+    for camera_id, video_path in enumerate(video_paths):
+        recorders = {stage: SampleRecorder() for stage in STAGES}
+        outbox = StubOutbox()
+        yolo_calls[0] = yolo_pixels[0] = 0
+        pipeline = detector.CameraPipeline(camera_id, video_path, min_area,
+                                           telegram_photo_interval=10,
+                                           outbox=outbox,
+                                           infer=counting_infer,
+                                           infer_batch=counting_infer_batch,
+                                           frame_width=frame_width,
+                                           realtime=False,
+                                           record_clips=False,
+                                           stage_observers=recorders,
+                                           use_tracker=use_tracker,
+                                           roi_inference=roi_inference)
+
+        start_time = time.perf_counter()
+        pipeline.run()
+        elapsed = time.perf_counter() - start_time
+
+        frames = len(recorders['capture'].samples)
+        videos.append({
+            'video': video_path,
+            'frames': frames,
+            'seconds': round(elapsed, 3),
+            'fps': round(frames / elapsed, 2) if elapsed > 0 else None,
+            'yolo_calls': yolo_calls[0],
+            'yolo_input_megapixels': round(yolo_pixels[0] / 1e6, 3),
+            'motion_frames': int(detector.MOTION_FRAMES_TOTAL.labels(camera=str(camera_id)).value),
+            'notifications': outbox.events,
+            'stages': summarize_stages(recorders),
+        })
+        for stage in STAGES:
+            total_recorders[stage].samples.extend(recorders[stage].samples)
+        total_frames += frames
+        total_yolo_calls += yolo_calls[0]
+        total_yolo_pixels += yolo_pixels[0]
+        total_seconds += elapsed
+
+    return {
+        'config': {
+            'videos': list(video_paths),
+            'min_area': min_area,
+            'detection_interval_seconds': detection_interval,
+            'frame_width': frame_width,
+            'use_tracker': use_tracker,
+            'roi_inference': roi_inference,
+            'device': detector.yolo_model.device,
+            'backend': detector.yolo_model.backend,
+        },
+        'model_load_seconds': round(model_load_seconds, 3),
+        'frames': total_frames,
+        'seconds': round(total_seconds, 3),
+        'fps': round(total_frames / total_seconds, 2) if total_seconds > 0 else None,
+        'yolo_calls': total_yolo_calls,
+        'yolo_calls_per_frame': round(total_yolo_calls / total_frames, 4) if total_frames else None,
+        'yolo_input_megapixels': round(total_yolo_pixels / 1e6, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': summarize_stages(total_recorders),
+        'videos': videos,
+    }
+
+
+def compare_with_baseline(result, baseline):
+    """Сравнивает ключевые показатели с сохраненным прогоном. Изменение в процентах относительно baseline."""
+    def change(current, previous):
+        if current is None or not previous:
+            return None
+        return round((current - previous) / previous * 100, 2)
+
+    comparison = {}
+    for key in ('fps', 'yolo_calls', 'yolo_input_megapixels', 'peak_rss_mb'):
+        comparison[key] = {'baseline': baseline.get(key), 'current': result.get(key),
+                           'change_pct': change(result.get(key), baseline.get(key))}
+    for stage in STAGES:
+        for q in PERCENTILES:
+            name = f'p{q}_ms'
+            current = result['stages'].get(stage, {}).get(name)
+            previous = baseline.get('stages', {}).get(stage, {}).get(name)
+            comparison[f'{stage}_{name}'] = {'baseline': previous, 'current': current,
+                                             'change_pct': change(current, previous)}
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера детектирования.")
+    parser.add_argument('videos', nargs='+', help="Видеофайлы для воспроизведения")
+    parser.add_argument('--min-area', type=int, default=1000, help="Минимальная площадь движения (MIN_AREA_FOR_MOTION)")
+    parser.add_argument('--detection-interval', type=float, default=3.0,
+                        help="Интервал принудительного запуска YOLO (DETECTION_INTERVAL_SECONDS)")
+    parser.add_argument('--width', type=int, default=480, help="Ширина кадра для обработки")
+    parser.add_argument('--no-tracker', action='store_true', help="Отключить трекер (YOLO на каждом кадре с движением)")
+    parser.add_argument('--roi', action='store_true', help="YOLO только на кропах областей движения")
+    parser.add_argument('--output', help="Сохранить результат в JSON-файл")
+    parser.add_argument('--baseline', help="JSON-файл предыдущего прогона для сравнения")
+    parser.add_argument('--max-fps-regression', type=float, default=None,
+                        help="Завершиться с кодом 1, если FPS упал больше чем на указанный процент")
+    args = parser.parse_args(argv)
+
+    # Журнал детектора уходит в stderr, чтобы в stdout оставался только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_benchmark(args.videos, args.min_area, args.detection_interval, args.width,
+                               use_tracker=not args.no_tracker, roi_inference=args.roi)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            result['comparison'] = compare_with_baseline(result, json.load(f))
+        fps_change = result['comparison']['fps']['change_pct']
+        if args.max_fps_regression is not None and fps_change is not None and fps_change < -args.max_fps_regression:
+            print(f"[Benchmark] FPS упал на {-fps_change}% (допустимо {args.max_fps_regression}%).", file=sys.stderr)
+            exit_code = 1
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
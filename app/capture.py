@@ -0,0 +1,222 @@
+# app/capture.py
+
+import os
+import threading
+import time
+
+import cv2
+
+import metrics
+from pipeline import LatestQueue
+
+# --- Параметры источников кадров ---
+DEFAULT_SOURCE_FPS = 25.0           # Частота кадров, если источник ее не сообщает
+CAPTURE_BUFFER_FRAMES = 4           # Декодирование наперед для файлов без пропуска кадров
+RECONNECT_INITIAL_BACKOFF_SECONDS = 0.5
+RECONNECT_MAX_BACKOFF_SECONDS = 30.0
+STREAM_OPEN_TIMEOUT_MS = 10000      # Таймауты FFmpeg для сетевых потоков: зависший поток переподключается
+STREAM_READ_TIMEOUT_MS = 5000
+FPS_WINDOW_SECONDS = 2.0            # Окно измерения фактической частоты кадров источника
+
+CAPTURE_SOURCE_FPS = metrics.Gauge('capture_source_fps', 'Измеренная частота декодирования кадров источника', ['camera'])
+CAPTURE_DROPPED_FRAMES = metrics.Counter('capture_dropped_frames_total',
+                                         'Декодированные кадры, вытесненные более новыми до обработки', ['camera'])
+CAPTURE_RECONNECTS_TOTAL = metrics.Counter('capture_reconnects_total', 'Переподключения к источнику кадров', ['camera'])
+
+
+def parse_source(source):
+    """
+    Определяет тип источника: номер устройства ('0' или 0), сетевой поток (rtsp://, http://, ...) или файл.
+    :return: (тип 'device' | 'stream' | 'file', аргумент для cv2.VideoCapture)
+    """
+    if isinstance(source, int):
+        return 'device', source
+    if str(source).strip().isdigit():
+        return 'device', int(source)
+    if '://' in str(source):
+        return 'stream', source
+    return 'file', source
+
+
+class CaptureSource:
+    """
+    Источник кадров с декодированием в отдельном потоке.
+    Живые источники (потоки, устройства) хранят только последний кадр: если обработка не успевает,
+    старые кадры вытесняются и считаются пропущенными. При ошибке чтения или конце потока источник
+    переподключается с экспоненциальной задержкой. Файл в реальном времени воспроизводится
+    по кругу с частотой источника, без реального времени - один раз, без пропусков, с буфером
+    декодирования наперед.
+    """
+
+    def __init__(self, source, camera='0', realtime=True, live=None, buffer_frames=CAPTURE_BUFFER_FRAMES):
+        """
+        :param source: Путь к файлу, URL потока или номер устройства.
+        :param camera: Метка камеры для метрик.
+        :param realtime: False - файл читается один раз без пропуска кадров (воспроизведение записей, бенчмарк).
+        :param live: Считать источник живым (None - по типу источника). True для файла дает
+                     локальную замену потока: конец файла обрабатывается как обрыв с переподключением.
+        :param buffer_frames: Глубина буфера декодирования наперед без реального времени.
+        """
+        self.source = source
+        self.kind, self._capture_arg = parse_source(source)
+        self.live = self.kind != 'file' if live is None else live
+        self.realtime = realtime or self.live
+        lossless = not self.realtime
+        self._frames = LatestQueue(buffer_frames if lossless else 1, lossless)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._cap = None
+
+        self.fps = DEFAULT_SOURCE_FPS # Заявленная частота источника
+        self.measured_fps = None
+        self.state = 'starting'       # starting -> running <-> reconnecting -> finished | failed
+        self.error = None
+        self.decoded = 0
+        self.reconnects = 0
+        self._camera = str(camera)
+        self._dropped_metric = CAPTURE_DROPPED_FRAMES.labels(camera=self._camera)
+        self._dropped_metric.set_function(lambda: self._frames.dropped)
+        CAPTURE_SOURCE_FPS.labels(camera=self._camera).set_function(lambda: self.measured_fps or 0.0)
+
+    @property
+    def dropped(self):
+        return self._frames.dropped
+
+    def start(self):
+        """
+        Открывает источник и запускает поток декодирования.
+        Возвращает False, если файл не найден или не открывается. Живой источник, который
+        не открылся сразу, продолжает попытки в фоне.
+        """
+        if self.kind == 'file' and not os.path.exists(self.source):
+            self.state, self.error = 'failed', f"Файл не найден: {self.source}"
+            return False
+        if not self._open() and not self.live:
+            self.state = 'failed'
+            return False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def read(self, timeout=None):
+        """
+        Следующий кадр. Возвращает (кадр, время начала декодирования, длительность декодирования) или None,
+        если за timeout кадра не было или источник закончился (см. finished).
+        """
+        return self._frames.get(timeout=timeout)
+
+    @property
+    def finished(self):
+        """True, если источник закончился и все кадры забраны."""
+        return self._frames.drained()
+
+    def release(self):
+        self._stop_event.set()
+        self._frames.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=STREAM_READ_TIMEOUT_MS / 1000)
+
+    def stats(self):
+        return {
+            'source': str(self.source),
+            'kind': self.kind,
+            'live': self.live,
+            'state': self.state,
+            'error': self.error,
+            'fps': self.fps,
+            'measured_fps': self.measured_fps,
+            'decoded': self.decoded,
+            'dropped': self.dropped,
+            'reconnects': self.reconnects,
+        }
+
+    def _open(self):
+        if self.kind == 'stream':
+            cap = cv2.VideoCapture(self._capture_arg, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, STREAM_OPEN_TIMEOUT_MS,
+                                    cv2.CAP_PROP_READ_TIMEOUT_MSEC, STREAM_READ_TIMEOUT_MS])
+        else:
+            cap = cv2.VideoCapture(self._capture_arg)
+        if not cap.isOpened():
+            cap.release()
+            self.error = f"Не удалось открыть: {self.source}"
+            print(f"[Capture ERROR] Не удалось открыть источник {self.source}")
+            return False
+        if self.live:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1) # Меньше задержка: буфер кадров держит LatestQueue
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_SOURCE_FPS
+        self._cap = cap
+        self.error = None
+        return True
+
+    def _close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _reconnect(self):
+        """Переподключение с экспоненциальной задержкой. Возвращает False, если источник остановлен."""
+        self._close()
+        self.state = 'reconnecting'
+        self.measured_fps = None
+        backoff = RECONNECT_INITIAL_BACKOFF_SECONDS
+        while not self._stop_event.wait(backoff):
+            self.reconnects += 1
+            CAPTURE_RECONNECTS_TOTAL.labels(camera=self._camera).inc()
+            print(f"[Capture] Переподключение к {self.source} (попытка {self.reconnects})...")
+            if self._open():
+                print(f"[Capture] Источник {self.source} снова доступен.")
+                return True
+            backoff = min(backoff * 2, RECONNECT_MAX_BACKOFF_SECONDS)
+        return False
+
+    def _run(self):
+        # Файл в реальном времени (и его замена живого потока) читается с частотой источника,
+        # иначе декодирование обгоняло бы камеру; настоящие потоки и устройства задают темп сами
+        paced = self.realtime and self.kind == 'file'
+        next_frame_time = time.monotonic()
+        window_start, window_frames = time.monotonic(), 0
+        try:
+            while not self._stop_event.is_set():
+                if self._cap is None and not self._reconnect():
+                    break
+                self.state = 'running'
+                capture_time = time.time()
+                ret, frame = self._cap.read()
+                if not ret:
+                    if self.live:
+                        print(f"[Capture ERROR] Обрыв источника {self.source}.")
+                        if not self._reconnect():
+                            break
+                        continue
+                    if not self.realtime:
+                        print(f"[Capture] Конец видеофайла: {self.source}")
+                        break
+                    print("[Capture] Конец видеофайла. Перезапуск видео для демонстрации.")
+                    self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+
+                self.decoded += 1
+                self._frames.put((frame, capture_time, time.time() - capture_time))
+
+                window_frames += 1
+                elapsed = time.monotonic() - window_start
+                if elapsed >= FPS_WINDOW_SECONDS:
+                    self.measured_fps = round(window_frames / elapsed, 2)
+                    window_start, window_frames = time.monotonic(), 0
+                if paced:
+                    next_frame_time = _pace(next_frame_time, 1.0 / self.fps)
+        finally:
+            self._close()
+            self.state = 'finished'
+            self._frames.close()
+
+
+def _pace(next_frame_time, frame_interval):
+    """Выдерживает частоту кадров источника. Возвращает время следующего кадра."""
+    next_frame_time += frame_interval
+    delay = next_frame_time - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+        return next_frame_time
+    return time.monotonic()
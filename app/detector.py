@@ -1,41 +1,158 @@
 # app/detector.py
 
+import collections
 import cv2
 import imutils
 import os
 import time
 import threading
 import datetime
-import requests
-import json
 
-from ultralytics import YOLO
-import torch
+from stream_hub import StreamHub
+from batch_inference import YOLO_IMGSZ, BatchInferenceWorker, parse_results
+from notifier import NotificationOutbox
+from pipeline import LatestQueue
+from tracker import IouTracker
+from adaptive import AdaptiveController
+from event_recorder import EventRecorder
+from event_query import EVENT_STORE_PATH
+from event_store import EventStore
+from model_loader import ModelLoader
+from capture import CaptureSource
+from image_collector import ImageCollector
+import roi
+import metrics
 
 # --- Конфигурация для модуля детектирования ---
-VIDEO_PATH = 'videos/video.mp4' 
-
-MIN_AREA = 1000 
 DETECTION_INTERVAL_SECONDS = 3.0 
 COLLECT_IMAGE_INTERVAL_SECONDS = 60 
 
 # Глобальные переменные для обмена данными внутри модуля или с main.py
-current_frame_for_stream = None # Кадр для веб-стриминга (с рамками)
-raw_frame_for_collection = None # Сырой кадр для сбора (без рамок)
+stream_hub = StreamHub() # Хаб для веб-стриминга: кодирует каждый кадр один раз для всех клиентов
+stream_hubs = {0: stream_hub} # Хабы по номерам камер (в мультикамерном режиме)
+camera_pipelines = {} # Работающие конвейеры по номерам камер
+frame_rings = {} # Кольца кадров в разделяемой памяти по номерам камер (детектор в отдельном процессе)
+notification_outbox = None # Фоновая очередь уведомлений Telegram (общая для всех камер)
+event_store = None # Индекс событий SQLite (общий для всех камер)
+image_collector = None # Сбор кадров для разметки (общий для всех камер, только в режиме сбора)
 detector_lock = threading.Lock() 
 
-# Инициализация YOLO модели
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-print(f"[YOLO Detector] Используется устройство: {DEVICE}")
+# Модель YOLO загружается лениво в фоне (start_* запускают загрузку), инференс ждет готовности
 yolo_model_path = os.path.join('shared_data', 'models', 'yolov8n.pt') 
-yolo_model = YOLO(yolo_model_path)
-print("[YOLO Detector] Модель YOLOv8n успешно загружена.")
+# Бэкенд инференса: auto (на CPU самый быстрый из PyTorch/ONNX/OpenVINO с точностью в пределах допуска), torch, onnx, openvino, openvino_int8
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'auto')
+MODEL_CALIBRATION_SOURCE = os.getenv('MODEL_CALIBRATION_SOURCE', os.path.join('videos', 'video.mp4')) # Клип для выбора бэкенда и калибровки INT8
+MODEL_ACCURACY_TOLERANCE = float(os.getenv('MODEL_ACCURACY_TOLERANCE', 0.05)) # Допустимое снижение совпадения с PyTorch
+yolo_model = ModelLoader(yolo_model_path, backend=INFERENCE_BACKEND,
+                         calibration_source=MODEL_CALIBRATION_SOURCE, accuracy_tolerance=MODEL_ACCURACY_TOLERANCE)
+
+# Замеры запуска (секунды), дополняются процессом веб-сервера и загрузчиком модели
+startup_timings = {}
+READY_MAX_FRAME_AGE_SECONDS = 5.0 # Камера считается работающей, если кадр был не раньше этого
 
 # --- Флаг для режима сбора изображений ---
 COLLECT_IMAGES_MODE = False
 COLLECTED_IMAGES_BASE_FOLDER = os.path.join('shared_data', 'collected_images')
 COLLECTED_IMAGES_CURRENT_RUN_FOLDER = None 
-last_collection_time = time.time()
+
+# --- Параметры общего инференса для мультикамерного режима ---
+INFERENCE_MAX_BATCH_SIZE = 8
+INFERENCE_MAX_WAIT_SECONDS = 0.02
+
+# --- Параметры конвейера обработки камеры ---
+FRAME_QUEUE_SIZE = 1        # Очереди кадров между стадиями: остается только последний кадр
+INFERENCE_QUEUE_SIZE = 1    # Очередь на YOLO: если инференс не успевает, старые кадры пропускаются
+STAGE_WAIT_TIMEOUT = 0.5    # Как часто стадии проверяют флаг остановки
+FRAME_WIDTH = 480           # Ширина кадра для обработки
+MOG2_WARMUP_FRAMES = 2      # Кадры после создания модели фона без решений о движении (первый кадр - весь передний план)
+
+# --- Трекер объектов ---
+USE_TRACKER = True                  # Между запусками YOLO объекты сопровождаются трекером
+TRACKER_DETECT_EVERY_N_FRAMES = 10  # Максимум кадров между запусками YOLO при активной сцене
+
+# --- Инференс по областям движения ---
+ROI_INFERENCE = False        # YOLO только на кропах областей движения из кадра полного разрешения
+ROI_SOURCE_MAX_WIDTH = 1920  # Ширина кадра, из которого вырезаются кропы
+
+# --- Адаптивное управление нагрузкой ---
+ADAPTIVE_CONTROL = True        # Регулятор меняет шаг кадров, частоту YOLO и разрешение под нагрузку
+TARGET_FPS = 15.0              # Целевая частота обработанных кадров
+LATENCY_BUDGET_SECONDS = 0.5   # Бюджет задержки от захвата до публикации
+FPS_SMOOTHING = 0.1         # Коэффициент сглаживания эффективного FPS
+
+# --- Клипы событий ---
+EVENT_CLIPS = True             # Записывать клипы с пред- и пост-записью и прикладывать их к уведомлениям
+
+# --- Метрики детектора (отдаются маршрутом /metrics) ---
+STAGE_SECONDS = metrics.Histogram('detector_stage_seconds',
+                                  'Задержка стадий конвейера (capture, mog2, yolo, publish, end_to_end)',
+                                  ['camera', 'stage'])
+FRAMES_TOTAL = metrics.Counter('detector_frames_total', 'Число захваченных кадров', ['camera'])
+MOTION_FRAMES_TOTAL = metrics.Counter('detector_motion_frames_total', 'Число кадров с движением (MOG2)', ['camera'])
+YOLO_INVOCATIONS_TOTAL = metrics.Counter('detector_yolo_invocations_total', 'Число запусков YOLO', ['camera'])
+YOLO_TRIGGERS_TOTAL = metrics.Counter('detector_yolo_triggers_total',
+                                      'Причины запуска YOLO (motion, new_blob, lost, periodic, interval)',
+                                      ['camera', 'reason'])
+ROI_CROPS_TOTAL = metrics.Counter('detector_roi_crops_total',
+                                  'Число кропов, переданных в YOLO в режиме инференса по областям движения',
+                                  ['camera'])
+YOLO_SKIPPED_FRAMES_TOTAL = metrics.Counter('detector_yolo_skipped_frames_total',
+                                            'Число кадров, для которых YOLO не запускался', ['camera'])
+QUEUE_DROPPED_TOTAL = metrics.Counter('detector_queue_dropped_total',
+                                      'Число кадров, вытесненных из очередей между стадиями', ['camera', 'queue'])
+ADAPTIVE_LEVEL = metrics.Gauge('detector_adaptive_level', 'Текущий уровень деградации адаптивного регулятора', ['camera'])
+EFFECTIVE_FPS = metrics.Gauge('detector_effective_fps', 'Сглаженная частота публикуемых кадров', ['camera'])
+
+
+def get_stream_hub(camera_id=0):
+    """Возвращает хаб веб-стриминга для камеры (создает его при первом обращении)."""
+    with detector_lock:
+        if camera_id not in stream_hubs:
+            stream_hubs[camera_id] = StreamHub()
+        return stream_hubs[camera_id]
+
+
+def detect_objects(frame, imgsz=YOLO_IMGSZ):
+    """Запускает YOLO на одном кадре и возвращает список детекций (x1, y1, x2, y2, conf, name)."""
+    results = yolo_model(frame, conf=0.5, verbose=False, imgsz=imgsz)
+    return parse_results(results[0], yolo_model.names)
+
+
+def detect_objects_batch(frames, imgsz=YOLO_IMGSZ):
+    """Запускает YOLO одним батчем на нескольких кадрах. Возвращает список детекций для каждого кадра."""
+    results = yolo_model(frames, conf=0.5, verbose=False, imgsz=imgsz)
+    return [parse_results(result, yolo_model.names) for result in results]
+
+
+def _init_notification_outbox(telegram_api_url):
+    """Создает и запускает фоновую очередь уведомлений Telegram."""
+    global notification_outbox
+
+    if notification_outbox is None:
+        notification_outbox = NotificationOutbox(telegram_api_url).start()
+    return notification_outbox
+
+
+def _init_event_store():
+    """Создает и запускает индекс событий."""
+    global event_store
+
+    if event_store is None:
+        event_store = EventStore(EVENT_STORE_PATH).start()
+    return event_store
+
+
+def _init_collection_mode(collect_images_mode):
+    """Включает режим сбора изображений: папка текущего запуска и фоновый сборщик кадров."""
+    global COLLECT_IMAGES_MODE, COLLECTED_IMAGES_CURRENT_RUN_FOLDER, image_collector
+
+    COLLECT_IMAGES_MODE = collect_images_mode
+    if COLLECT_IMAGES_MODE and image_collector is None:
+        COLLECTED_IMAGES_CURRENT_RUN_FOLDER = os.path.join(COLLECTED_IMAGES_BASE_FOLDER, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        image_collector = ImageCollector(COLLECTED_IMAGES_BASE_FOLDER, COLLECTED_IMAGES_CURRENT_RUN_FOLDER,
+                                         names=lambda: yolo_model.names,
+                                         interval_seconds=COLLECT_IMAGE_INTERVAL_SECONDS).start()
+        print(f"[Detector] Режим сбора изображений активирован. Изображения будут сохраняться в: {COLLECTED_IMAGES_CURRENT_RUN_FOLDER}")
 
 
 # --- Главный поток обработки видео ---
@@ -54,117 +171,478 @@ def start_video_detection(video_path, min_area, telegram_photo_interval,
     :param telegram_api_url: URL для отправки задач Telegram-боту.
     :param web_server_url: URL веб-сервера Flask для ссылки в Telegram.
     """
-    global current_frame_for_stream, detector_lock
-    global raw_frame_for_collection, COLLECT_IMAGES_MODE, COLLECTED_IMAGES_CURRENT_RUN_FOLDER, last_collection_time
-    global DETECTION_INTERVAL_SECONDS, COLLECT_IMAGE_INTERVAL_SECONDS
-
-    COLLECT_IMAGES_MODE = collect_images_mode
-    if COLLECT_IMAGES_MODE:
-        COLLECTED_IMAGES_CURRENT_RUN_FOLDER = os.path.join(COLLECTED_IMAGES_BASE_FOLDER, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
-        if not os.path.exists(COLLECTED_IMAGES_CURRENT_RUN_FOLDER):
-            os.makedirs(COLLECTED_IMAGES_CURRENT_RUN_FOLDER)
-            print(f"[Detector] Режим сбора изображений активирован. Изображения будут сохраняться в: {COLLECTED_IMAGES_CURRENT_RUN_FOLDER}")
-        else:
-            print(f"[Detector] Режим сбора изображений активирован. Изображения будут сохраняться в существующую папку: {COLLECTED_IMAGES_CURRENT_RUN_FOLDER}")
-
-
-    print(f"[Detector] Попытка открыть видеофайл: {video_path}")
-    
-    if not os.path.exists(video_path):
-        print(f"[Detector ERROR] Ошибка: Файл не найден по пути: {video_path}")
-        print("[Detector ERROR] Пожалуйста, убедитесь, что 'video.mp4' находится в папке 'app/videos/' внутри контейнера.")
-        return
-
-    cap = cv2.VideoCapture(video_path)
-
-    if not cap.isOpened():
-        print(f"[Detector ERROR] Не удалось открыть видеофайл {video_path}")
-        return
-
-    print("[Detector] Видеофайл успешно открыт.")
-
-    fgbg = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
-    last_telegram_photo_time = time.time()
-    last_yolo_run_time = time.time()
-
-    while True:
-        start_loop_time = time.time() 
-
-        ret, frame = cap.read()
-
-        if not ret:
-            print("[Detector] Конец видеофайла. Перезапуск видео для демонстрации.")
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-            continue
-
-        frame = imutils.resize(frame, width=480) 
-        original_frame_copy = frame.copy() # Сырой кадр, без разметки
-
-        detected_objects_names = []
-        motion_detected_mog2 = False
+    yolo_model.start()
+    _init_collection_mode(collect_images_mode)
+    outbox = _init_notification_outbox(telegram_api_url)
+    store = _init_event_store()
+    run_camera(0, video_path, min_area, telegram_photo_interval,
+               output_folder=output_folder,
+               outbox=outbox,
+               web_server_url=web_server_url,
+               event_store=store)
+
+
+def start_multi_camera_detection(video_sources, min_area, telegram_photo_interval,
+                                 collect_images_mode=False,
+                                 output_folder='output',
+                                 telegram_api_url='http://telegram:5001/send_task',
+                                 web_server_url='http://127.0.0.1:5000/',
+                                 max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                                 max_wait_seconds=INFERENCE_MAX_WAIT_SECONDS):
+    """
+    Запускает обработку нескольких камер.
+    Каждая камера читает кадры и ищет движение в своем потоке, а YOLO выполняется
+    в одном общем потоке, который собирает кадры всех камер в батчи.
+    :param video_sources: Список путей к видеофайлам (по одному на камеру).
+    :param max_batch_size: Максимальное число кадров в батче YOLO.
+    :param max_wait_seconds: Максимальное ожидание добора батча.
+    Остальные параметры - как в start_video_detection.
+    """
+    yolo_model.start()
+    _init_collection_mode(collect_images_mode)
+    outbox = _init_notification_outbox(telegram_api_url)
+    store = _init_event_store()
+    # Устройство выбирает загрузчик модели; поток инференса ждет готовности модели при первом батче
+    inference_worker = BatchInferenceWorker(yolo_model, None,
+                                            max_batch_size=max_batch_size,
+                                            max_wait_seconds=max_wait_seconds).start()
+
+    camera_threads = []
+    for camera_id, video_path in enumerate(video_sources):
+        camera_thread = threading.Thread(target=run_camera,
+                                         args=(camera_id, video_path, min_area, telegram_photo_interval),
+                                         kwargs={'output_folder': output_folder,
+                                                 'outbox': outbox,
+                                                 'event_store': store,
+                                                 'web_server_url': web_server_url,
+                                                 'infer': inference_worker.infer,
+                                                 'infer_batch': inference_worker.infer_many,
+                                                 'camera_label': f"Камера {camera_id}"},
+                                         daemon=True)
+        camera_thread.start()
+        camera_threads.append(camera_thread)
+    print(f"[Detector] Запущено камер: {len(camera_threads)}")
+
+    for camera_thread in camera_threads:
+        camera_thread.join()
+
+
+def run_camera(camera_id, video_path, min_area, telegram_photo_interval,
+               output_folder='output',
+               outbox=None,
+               web_server_url='http://127.0.0.1:5000/',
+               infer=detect_objects,
+               camera_label=None,
+               infer_batch=detect_objects_batch,
+               event_store=None):
+    """
+    Обработка одной камеры: чтение кадров, MOG2, YOLO, стриминг и уведомления.
+    Блокирует вызывающий поток, пока работает захват кадров.
+    :param camera_id: Номер камеры (определяет хаб веб-стриминга).
+    :param outbox: Очередь уведомлений Telegram (None - уведомления не отправляются).
+    :param infer: Функция инференса: (кадр, imgsz) -> список детекций (x1, y1, x2, y2, conf, name).
+    :param camera_label: Название камеры для сообщений и имен файлов (None - одиночный режим).
+    :param infer_batch: Функция инференса для нескольких кадров (кропы в режиме roi_inference).
+    :param event_store: Индекс событий (None - события не индексируются).
+    """
+    pipeline = CameraPipeline(camera_id, video_path, min_area, telegram_photo_interval,
+                              output_folder=output_folder,
+                              outbox=outbox,
+                              web_server_url=web_server_url,
+                              infer=infer,
+                              camera_label=camera_label,
+                              infer_batch=infer_batch,
+                              event_store=event_store)
+    pipeline.run()
+
+
+class CameraPipeline:
+    """
+    Конвейер обработки одной камеры из отдельных стадий-потоков:
+    захват/декодирование -> движение (MOG2) -> инференс (YOLO) и уведомления,
+                                            -> публикация кадра для веб-стрима.
+    Стадии связаны ограниченными очередями LatestQueue ("побеждает последний кадр"),
+    поэтому медленный YOLO не задерживает захват, стрим и поиск движения.
+    """
 
-        # --- MOG2: Обнаружение движения ---
+    def __init__(self, camera_id, video_path, min_area, telegram_photo_interval,
+                 output_folder='output',
+                 outbox=None,
+                 web_server_url='http://127.0.0.1:5000/',
+                 infer=detect_objects,
+                 camera_label=None,
+                 frame_width=FRAME_WIDTH,
+                 realtime=True,
+                 stage_observers=None,
+                 use_tracker=USE_TRACKER,
+                 infer_batch=detect_objects_batch,
+                 roi_inference=ROI_INFERENCE,
+                 adaptive=ADAPTIVE_CONTROL,
+                 record_clips=EVENT_CLIPS,
+                 event_store=None):
+        """
+        :param frame_width: Ширина кадра для обработки.
+        :param realtime: True - видеофайл воспроизводится в реальном времени по кругу, кадры могут пропускаться.
+                         False - файл проигрывается один раз с максимальной скоростью без пропуска кадров
+                         (воспроизведение записей, бенчмарк); интервалы отсчитываются по времени видео.
+        :param stage_observers: Словарь стадия -> объект с методом observe(seconds), заменяющий гистограммы.
+        :param use_tracker: True - YOLO запускается только при появлении новых объектов, потере трека
+                            или раз в TRACKER_DETECT_EVERY_N_FRAMES кадров, а не на каждом кадре с движением.
+        :param infer_batch: Функция инференса для нескольких кадров: (список кадров, imgsz) -> список списков детекций.
+        :param roi_inference: True - YOLO запускается только на кропах областей движения, вырезанных
+                              из кадра полного разрешения (до ROI_SOURCE_MAX_WIDTH), а не на кадре frame_width.
+        :param adaptive: True - в реальном времени AdaptiveController подстраивает шаг кадров, частоту YOLO
+                         и разрешение обработки, чтобы держать TARGET_FPS и LATENCY_BUDGET_SECONDS.
+        :param record_clips: True - EventRecorder пишет клипы событий в output_folder, путь клипа
+                             передается в уведомлении.
+        :param event_store: Индекс событий EventStore (None - события не индексируются).
+        """
+        self.camera_id = camera_id
+        self.video_path = video_path
+        self.min_area = min_area
+        self.telegram_photo_interval = telegram_photo_interval
+        self.output_folder = output_folder
+        self.outbox = outbox
+        self.web_server_url = web_server_url
+        self.infer = infer
+        self.infer_batch = infer_batch
+        self.roi_inference = roi_inference
+        self.adaptive = adaptive and realtime
+        self.controller = None
+        self.camera_label = camera_label
+        self.frame_width = frame_width
+        self.realtime = realtime
+        self.tracker = IouTracker(TRACKER_DETECT_EVERY_N_FRAMES) if use_tracker else None
+        self._new_objects = collections.Counter() # Новые треки с момента последнего уведомления
+
+        # В отдельном процессе кадры публикуются в кольцо разделяемой памяти, которое читает веб-сервер
+        self.hub = frame_rings[camera_id] if camera_id in frame_rings else get_stream_hub(camera_id)
+        self.file_prefix = f"cam{camera_id}_" if camera_label else ""
+        self.recorder = EventRecorder(output_folder, self.file_prefix, str(camera_id)) if record_clips else None
+        self._last_clip_path = None
+        self._clip_confidences = {} # Наибольшая уверенность по классам, уже записанная в индекс для текущего клипа
+        self.event_store = event_store
+
+        # Состояние захвата для /healthz и /readyz: starting -> running -> finished | failed
+        self.capture_state = 'starting'
+        self.capture_error = None
+        self.first_frame_seconds = None
+        self.last_frame_time = None
+        self._run_started = None
+        self.source = None
+
+        lossless = not realtime
+        self.motion_queue = LatestQueue(FRAME_QUEUE_SIZE, lossless)
+        self.inference_queue = LatestQueue(INFERENCE_QUEUE_SIZE, lossless)
+        self.publish_queue = LatestQueue(FRAME_QUEUE_SIZE, lossless)
+        self._stop_event = threading.Event()
+
+        # Интервалы отсчитываются от запуска: по часам или от начала видео при воспроизведении
+        self.last_telegram_photo_time = time.time() if realtime else 0.0
+
+        camera = str(camera_id)
+        stage_observers = stage_observers or {}
+        def stage_observer(stage):
+            return stage_observers.get(stage) or STAGE_SECONDS.labels(camera=camera, stage=stage)
+        self._capture_seconds = stage_observer('capture')
+        self._mog2_seconds = stage_observer('mog2')
+        self._yolo_seconds = stage_observer('yolo')
+        self._publish_seconds = stage_observer('publish')
+        self._end_to_end_seconds = stage_observer('end_to_end')
+        self._frames_total = FRAMES_TOTAL.labels(camera=camera)
+        self._motion_frames_total = MOTION_FRAMES_TOTAL.labels(camera=camera)
+        self._yolo_invocations_total = YOLO_INVOCATIONS_TOTAL.labels(camera=camera)
+        self._yolo_skipped_frames_total = YOLO_SKIPPED_FRAMES_TOTAL.labels(camera=camera)
+        self._yolo_triggers_total = {reason: YOLO_TRIGGERS_TOTAL.labels(camera=camera, reason=reason)
+                                     for reason in ('motion', 'new_blob', 'lost', 'periodic', 'interval')}
+        self._effective_fps = EFFECTIVE_FPS.labels(camera=camera)
+        self._roi_crops_total = ROI_CROPS_TOTAL.labels(camera=camera)
+        for queue_name, stage_queue in (('motion', self.motion_queue),
+                                        ('inference', self.inference_queue),
+                                        ('publish', self.publish_queue)):
+            QUEUE_DROPPED_TOTAL.labels(camera=camera, queue=queue_name).set_function(lambda q=stage_queue: q.dropped)
+
+    def run(self):
+        print(f"[Detector] Попытка открыть источник: {self.video_path}")
+        self._run_started = time.monotonic()
+        camera_pipelines[self.camera_id] = self
+
+        # Файл, RTSP/HTTP-поток или номер устройства; декодирование идет в потоке источника
+        self.source = CaptureSource(self.video_path, camera=str(self.camera_id), realtime=self.realtime)
+        if not self.source.start():
+            print(f"[Detector ERROR] Ошибка: {self.source.error}")
+            if self.source.kind == 'file':
+                print("[Detector ERROR] Пожалуйста, убедитесь, что 'video.mp4' находится в папке 'app/videos/' внутри контейнера.")
+            self.capture_state, self.capture_error = 'failed', self.source.error
+            return
+
+        print(f"[Detector] Источник открыт ({self.source.kind}).")
+        self.capture_state = 'running'
+
+        source_fps = self.source.fps
+        if self.adaptive:
+            self.controller = AdaptiveController(TARGET_FPS, LATENCY_BUDGET_SECONDS, source_fps)
+            ADAPTIVE_LEVEL.labels(camera=str(self.camera_id)).set_function(lambda: self.controller.level)
+        if self.recorder is not None:
+            self.recorder.start()
+
+        stage_threads = [threading.Thread(target=stage, daemon=True)
+                         for stage in (self._motion_stage, self._inference_stage, self._publish_stage)]
+        for stage_thread in stage_threads:
+            stage_thread.start()
+
+        try:
+            self._capture_stage(source_fps)
+            # Стадии дорабатывают оставшиеся в очередях кадры и завершаются по цепочке
+            for stage_thread in stage_threads:
+                stage_thread.join()
+        finally:
+            self.stop()
+            if self.recorder is not None:
+                self.recorder.flush() # Дописываем клип, если видео закончилось во время события
+            self.capture_state = 'finished'
+        print("[Detector] Поток обработки видео завершил работу.")
+
+    def health(self):
+        """Состояние захвата камеры для /healthz и /readyz."""
+        now = time.monotonic()
+        return {
+            'state': self.capture_state,
+            'error': self.capture_error,
+            'first_frame_seconds': self.first_frame_seconds,
+            'last_frame_age_seconds': round(now - self.last_frame_time, 3) if self.last_frame_time is not None else None,
+            'source': self.source.stats() if self.source is not None else None,
+        }
+
+    def stop(self):
+        """Немедленная остановка всех стадий без обработки оставшихся кадров."""
+        self._stop_event.set()
+        if self.source is not None:
+            self.source.release()
+        self.motion_queue.close()
+        self.inference_queue.close()
+        self.publish_queue.close()
+
+    def _next_packet(self, stage_queue):
+        """
+        Ждет следующий кадр для стадии. Возвращает None, когда стадия должна завершиться:
+        по stop() или после того, как предыдущая стадия закрыла очередь и все кадры обработаны.
+        """
+        while not self._stop_event.is_set():
+            packet = stage_queue.get(timeout=STAGE_WAIT_TIMEOUT)
+            if packet is not None:
+                return packet
+            if stage_queue.drained():
+                return None
+        return None
+
+    # --- Стадия 1: захват (кадры декодирует поток CaptureSource, темп задает источник) ---
+    def _capture_stage(self, source_fps):
+        frame_interval = 1.0 / source_fps
+        frame_seq = 0
+        decoded_frames = 0
+
+        try:
+            while not self._stop_event.is_set():
+                item = self.source.read(timeout=STAGE_WAIT_TIMEOUT)
+                if item is None:
+                    if self.source.finished:
+                        break
+                    continue
+                # start_capture_time - начало декодирования: сквозная задержка включает ожидание в буфере источника
+                frame, start_capture_time, decode_seconds = item
+                start_resize_time = time.time()
+
+                decoded_frames += 1
+                frame_width = self.frame_width
+                if self.controller is not None:
+                    settings = self.controller.settings
+                    frame_width = int(self.frame_width * settings['frame_scale']) // 16 * 16
+                    if decoded_frames % settings['frame_stride']:
+                        continue # Кадр декодирован, но пропускается по решению регулятора
+
+                source_frame = None
+                if self.roi_inference:
+                    # Кадр полного разрешения нужен только для кропов YOLO
+                    source_frame = frame if frame.shape[1] <= ROI_SOURCE_MAX_WIDTH else imutils.resize(frame, width=ROI_SOURCE_MAX_WIDTH)
+                frame = imutils.resize(frame, width=frame_width) # Сырой кадр, без разметки
+                self._capture_seconds.observe(decode_seconds + time.time() - start_resize_time)
+                self._frames_total.inc()
+
+                frame_seq += 1
+                # timestamp - время для интервалов (YOLO, Telegram, сбор кадров):
+                # в реальном времени это время захвата, при воспроизведении - позиция в видео
+                timestamp = start_capture_time if self.realtime else frame_seq * frame_interval
+                self.motion_queue.put({'seq': frame_seq, 'frame': frame, 'source_frame': source_frame,
+                                       'capture_time': start_capture_time, 'timestamp': timestamp})
+        finally:
+            self.motion_queue.close()
+
+    # --- Стадия 2: обнаружение движения (MOG2) ---
+    def _motion_stage(self):
+        self._fgbg = None
+        self._fgbg_warmup = 0
+        self._last_yolo_run_time = None
+        self._frames_since_yolo = 0
+
+        try:
+            while True:
+                packet = self._next_packet(self.motion_queue)
+                if packet is None:
+                    break
+                self._process_motion(packet)
+        finally:
+            self.inference_queue.close()
+            self.publish_queue.close()
+
+    def _process_motion(self, packet):
+        """MOG2 для одного кадра и решение о запуске YOLO."""
         start_mog2_time = time.time() 
-        gray = cv2.cvtColor(original_frame_copy, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(packet['frame'], cv2.COLOR_BGR2GRAY)
+        if self._fgbg is None or gray.shape != self._fgbg_shape:
+            # Модель фона и треки привязаны к разрешению: при его смене регулятором начинаем заново
+            self._fgbg = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
+            self._fgbg_shape = gray.shape
+            self._fgbg_warmup = MOG2_WARMUP_FRAMES
+            if self.tracker is not None:
+                self.tracker.reset()
         gray = cv2.GaussianBlur(gray, (21, 21), 0)
-        fgmask = fgbg.apply(gray)
+        fgmask = self._fgbg.apply(gray)
         thresh = cv2.threshold(fgmask, 25, 255, cv2.THRESH_BINARY)[1]
         thresh = cv2.erode(thresh, None, iterations=2)
         thresh = cv2.dilate(thresh, None, iterations=2)
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cnts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         cnts = imutils.grab_contours(cnts)
 
-        for c in cnts:
-            if cv2.contourArea(c) < min_area:
-                continue
-            motion_detected_mog2 = True
-            (x, y, w, h) = cv2.boundingRect(c)
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2) # Зеленая рамка MOG2
+        motion_boxes = [cv2.boundingRect(c) for c in cnts if cv2.contourArea(c) >= self.min_area]
         end_mog2_time = time.time() 
+        self._mog2_seconds.observe(end_mog2_time - start_mog2_time)
+
+        if self._fgbg_warmup > 0:
+            # Новая модель фона (запуск или смена разрешения регулятором) считает первый кадр целиком
+            # передним планом: эти кадры только обучают фон и не запускают YOLO и события
+            self._fgbg_warmup -= 1
+            packet['motion'] = False
+            packet['motion_boxes'] = []
+            self.publish_queue.put(packet)
+            return
+
+        packet['motion'] = bool(motion_boxes)
+        packet['motion_boxes'] = motion_boxes
+        if packet['motion']:
+            self._motion_frames_total.inc()
+        self.publish_queue.put(packet)
+
+        # Без трекера YOLO запускается на каждом кадре с движением, с трекером - по решению трекера.
+        # В любом случае - не реже DETECTION_INTERVAL_SECONDS
+        current_time = packet['timestamp']
+        if self._last_yolo_run_time is None:
+            self._last_yolo_run_time = current_time
+        self._frames_since_yolo += 1
+
+        yolo_min_gap_frames = 0
+        if self.controller is not None:
+            yolo_min_gap_frames = self.controller.settings['yolo_min_gap_frames']
+            if self.tracker is not None:
+                self.tracker.detect_every_n_frames = max(TRACKER_DETECT_EVERY_N_FRAMES, yolo_min_gap_frames)
+
+        if self.tracker is not None:
+            _, reason = self.tracker.step(motion_boxes)
+        else:
+            reason = 'motion' if packet['motion'] else None
+        if reason is None and current_time - self._last_yolo_run_time >= DETECTION_INTERVAL_SECONDS:
+            reason = 'interval'
+        if reason is not None and reason != 'interval' and self._frames_since_yolo <= yolo_min_gap_frames:
+            reason = None # Регулятор ограничил частоту YOLO
+
+        if reason is not None:
+            self._yolo_triggers_total[reason].inc()
+            if self.tracker is not None:
+                self.tracker.mark_pending()
+            self.inference_queue.put(packet)
+            self._last_yolo_run_time = current_time
+            self._frames_since_yolo = 0
+        else:
+            self._yolo_skipped_frames_total.inc()
 
+    # --- Стадия 3: обнаружение объектов (YOLO) и уведомления ---
+    def _inference_stage(self):
+        while True:
+            packet = self._next_packet(self.inference_queue)
+            if packet is None:
+                break
 
-        # --- YOLO: Обнаружение объектов ---
-        current_time = time.time()
-        if motion_detected_mog2 or (current_time - last_yolo_run_time >= DETECTION_INTERVAL_SECONDS):
             start_yolo_time = time.time() 
-            results = yolo_model(original_frame_copy, conf=0.5, verbose=False, device=DEVICE)
-
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    conf = round(float(box.conf[0]), 2)
-                    cls = int(box.cls[0])
-                    name = yolo_model.names[cls]
-
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 0, 0), 2) # Синяя рамка YOLO
-                    text = f"{name} {conf}"
-                    cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-
-                    detected_objects_names.append(name)
+            try:
+                detections = self._detect(packet)
+            except Exception as e:
+                print(f"[Detector ERROR] Ошибка инференса YOLO: {e}")
+                if self.tracker is not None:
+                    self.tracker.cancel_pending()
+                continue
             end_yolo_time = time.time() 
-            last_yolo_run_time = current_time 
-
-
-        # --- Обновление кадра для веб-стриминга ---
-        with detector_lock:
-            start_copy_time = time.time() 
-            current_frame_for_stream = original_frame_copy.copy() # <--- ИЗМЕНЕНО: Отправляем неразмеченный кадр для веб-стрима
-            raw_frame_for_collection = original_frame_copy.copy() # Этот кадр всегда остается неразмеченным
-            end_copy_time = time.time() 
-
-
-        # --- Логика отправки в Telegram (через HTTP-запрос) ---
-        if motion_detected_mog2 and (current_time - last_telegram_photo_time >= telegram_photo_interval):
+            self._yolo_seconds.observe(end_yolo_time - start_yolo_time)
+            self._yolo_invocations_total.inc()
+            if self.controller is not None:
+                self.controller.observe_detection(end_yolo_time - packet['capture_time'])
+
+            if self.tracker is not None:
+                new_tracks = self.tracker.update(detections)
+                self._new_objects.update(track.name for track in new_tracks)
+            if packet['motion']:
+                self._handle_motion_event(packet, detections)
+
+    def _detect(self, packet):
+        """
+        YOLO для кадра. В режиме roi_inference - батч кропов областей движения из кадра
+        полного разрешения с переводом детекций в координаты обрабатываемого кадра.
+        """
+        source_frame = packet.get('source_frame')
+        if self.roi_inference and source_frame is not None:
+            frame_height, frame_width = source_frame.shape[:2]
+            scale = frame_width / packet['frame'].shape[1]
+            regions = roi.plan_crops(packet['motion_boxes'], scale, frame_width, frame_height)
+            if regions is not None:
+                crops = [source_frame[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+                # Вход YOLO по размеру кропов; если кропы все равно дороже кадра целиком - YOLO на весь кадр
+                imgsz = roi.crop_imgsz(regions)
+                if roi.inference_pixels([crop.shape[:2] for crop in crops], imgsz) < roi.inference_pixels([packet['frame'].shape[:2]]):
+                    self._roi_crops_total.inc(len(crops))
+                    crop_detections = self.infer_batch(crops, imgsz) if len(crops) > 1 else [self.infer(crops[0], imgsz)]
+                    return roi.map_detections(crop_detections, regions, scale)
+        return self.infer(packet['frame'])
+
+    def _handle_motion_event(self, packet, detections):
+        """Отправка в Telegram, сбор кадров для разметки и индексация события по кадру с движением."""
+        frame = packet['frame']
+        current_time = packet['timestamp']
+        detected_objects_names = [name for _, _, _, _, _, name in detections]
+        photo_path = collected_path = None
+
+        # Каждое срабатывание продлевает клип текущего события или начинает новый
+        clip_path = new_clip_path = None
+        if self.recorder is not None:
+            clip_path = self.recorder.trigger(current_time, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+            if clip_path != self._last_clip_path:
+                new_clip_path = self._last_clip_path = clip_path
+                self._clip_confidences = {}
+
+        # --- Логика отправки в Telegram (через фоновую очередь) ---
+        if self.outbox is not None and (current_time - self.last_telegram_photo_time >= self.telegram_photo_interval):
             timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            photo_filename = f"motion_detected_{timestamp}.jpg"
-            full_photo_path = os.path.join(output_folder, photo_filename) 
-            cv2.imwrite(full_photo_path, raw_frame_for_collection) 
+            photo_filename = f"motion_detected_{self.file_prefix}{timestamp}.jpg"
+            full_photo_path = os.path.join(self.output_folder, photo_filename) 
 
-            message_parts = ["Обнаружено движение!"]
+            message_parts = [f"{self.camera_label}: обнаружено движение!" if self.camera_label else "Обнаружено движение!"]
             voice_message_text = "Обнаружено движение. " 
 
-            if detected_objects_names:
+            if self._new_objects:
+                # Трекер знает, какие объекты появились впервые: сообщаем только о них
+                new_objects = ", ".join(f"{count} {name}" for name, count in sorted(self._new_objects.items()))
+                message_parts.append(f"Новые объекты: {new_objects}")
+                voice_message_text += f"Новые объекты: {new_objects}."
+                self._new_objects.clear()
+            elif detected_objects_names:
                 unique_objects = ", ".join(sorted(list(set(detected_objects_names))))
                 message_parts.append(f"Объекты: {unique_objects}")
                 voice_message_text += f"Объекты: {unique_objects}."
@@ -172,45 +650,115 @@ def start_video_detection(video_path, min_area, telegram_photo_interval,
                 message_parts.append("Объекты не классифицированы.")
                 voice_message_text += "Объекты не классифицированы."
 
-            message_parts.append(f"\nПосмотреть Live-стрим: {web_server_url}") 
+            message_parts.append(f"\nПосмотреть Live-стрим: {self.web_server_url}") 
 
             message_text_telegram = f"{' '.join(message_parts)} в {datetime.datetime.now().strftime('%H:%M:%S')}!"
             
-            # Отправляем HTTP POST-запрос на Telegram API
-            try:
-                payload = {
-                    'photo_path': full_photo_path,
-                    'message_text': message_text_telegram,
-                    'voice_text': voice_message_text
-                }
-                response = requests.post(telegram_api_url, json=payload, timeout=5)
-                response.raise_for_status() 
-                print(f"[Detector] Задача для Telegram успешно отправлена по HTTP: {response.json()}")
-            except requests.exceptions.RequestException as e:
-                print(f"[Detector ERROR] Ошибка при отправке задачи в Telegram API: {e}")
-
-            last_telegram_photo_time = current_time
-
-        # --- Режим сбора изображений для разметки ---
-        if COLLECT_IMAGES_MODE and motion_detected_mog2 and (current_time - last_collection_time >= COLLECT_IMAGE_INTERVAL_SECONDS):
-            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            collection_photo_filename = f"collected_{timestamp}.jpg"
-            full_collection_photo_path = os.path.join(COLLECTED_IMAGES_CURRENT_RUN_FOLDER, collection_photo_filename)
-            
-            cv2.imwrite(full_collection_photo_path, raw_frame_for_collection)
-            print(f"[Detector] Кадр сохранен для разметки: {full_collection_photo_path}")
-            last_collection_time = current_time
+            # Снимок сохраняется и отправляется Telegram-боту в фоновом потоке очереди
+            self.outbox.enqueue(frame, full_photo_path, message_text_telegram, voice_message_text, clip_path,
+                                camera=self.camera_id)
+            photo_path = full_photo_path
+
+            self.last_telegram_photo_time = current_time
+
+        # --- Режим сбора изображений для разметки: отбор и дедупликация здесь, запись в фоне ---
+        if COLLECT_IMAGES_MODE and image_collector is not None:
+            collected_path = image_collector.offer(frame, detections, self.camera_id, current_time)
+
+        # --- Индекс событий: только события, после которых на диске остаются файлы ---
+        # Детекции более поздних срабатываний того же клипа дописываются в его событие,
+        # если добавляют класс или повышают уверенность
+        if self.event_store is not None:
+            improved = {}
+            for _, _, _, _, conf, name in detections:
+                if conf > max(improved.get(name, 0.0), self._clip_confidences.get(name, 0.0)):
+                    improved[name] = conf
+            if photo_path or collected_path or new_clip_path:
+                motion_area = sum(w * h for _, _, w, h in packet['motion_boxes'])
+                self.event_store.add_event(time.time(), self.camera_id, motion_area, detections,
+                                           photo_path=photo_path, clip_path=clip_path, collected_path=collected_path)
+            elif clip_path and improved:
+                self.event_store.merge_clip_detections(clip_path, improved.items())
+            if clip_path:
+                self._clip_confidences.update(improved)
+
+    # --- Стадия 4: публикация кадра для веб-стриминга ---
+    def _publish_stage(self):
+        effective_fps = 0.0
+        last_publish_time = None
+
+        while True:
+            packet = self._next_packet(self.publish_queue)
+            if packet is None:
+                break
+
+            start_publish_time = time.time()
+            # Кадр больше не изменяется ни одной стадией, поэтому хаб получает его без копирования
+            # (кольцо разделяемой памяти копирует его один раз - в свой слот)
+            self.hub.publish(packet['frame']) # Отправляем неразмеченный кадр для веб-стрима
+            self.last_frame_time = time.monotonic()
+            if self.first_frame_seconds is None:
+                self.first_frame_seconds = round(self.last_frame_time - self._run_started, 3)
+                startup_timings.setdefault('first_frame_seconds', {})[str(self.camera_id)] = self.first_frame_seconds
+            if self.recorder is not None:
+                self.recorder.add_frame(packet['frame'], packet['timestamp'])
+
+            end_publish_time = time.time()
+            self._publish_seconds.observe(end_publish_time - start_publish_time)
+
+            frame_processing_time = end_publish_time - packet['capture_time']
+            self._end_to_end_seconds.observe(frame_processing_time)
+            if self.controller is not None:
+                self.controller.observe(frame_processing_time)
+
+            if last_publish_time is not None and end_publish_time > last_publish_time:
+                instant_fps = 1.0 / (end_publish_time - last_publish_time)
+                effective_fps = instant_fps if not effective_fps else effective_fps + FPS_SMOOTHING * (instant_fps - effective_fps)
+                self._effective_fps.set(effective_fps)
+            last_publish_time = end_publish_time
 
-        # --- Конец итерации цикла ---
-        end_loop_time = time.time() 
-        frame_processing_time = end_loop_time - start_loop_time
-
-
-    cap.release()
-    print("[Detector] Поток обработки видео завершил работу.")
 
 # --- Вспомогательные функции для Flask ---
-def get_current_frame_for_stream():
-    """Возвращает текущий кадр для веб-стриминга."""
-    with detector_lock:
-        return current_frame_for_stream.copy() if current_frame_for_stream is not None else None
+def health_status():
+    """
+    Готовность детектора: модель загружена и прогрета, все камеры выдают свежие кадры.
+    Возвращает также замеры запуска (импорт, загрузка и прогрев модели, первый кадр камер).
+    """
+    cameras = {str(camera_id): pipeline.health() for camera_id, pipeline in list(camera_pipelines.items())}
+    reasons = []
+    if not yolo_model.ready:
+        reasons.append(f"модель: {yolo_model.state}")
+    if not cameras:
+        reasons.append("камеры еще не запущены")
+    for camera_id, camera in cameras.items():
+        age = camera['last_frame_age_seconds']
+        if camera['state'] != 'running' or age is None or age > READY_MAX_FRAME_AGE_SECONDS:
+            reasons.append(f"камера {camera_id}: {camera['state']}, возраст кадра {age}")
+    startup = dict(startup_timings)
+    startup['model'] = yolo_model.timings
+    return {'ready': not reasons, 'reasons': reasons, 'model': yolo_model.status(),
+            'cameras': cameras, 'startup': startup}
+
+
+def handle_request(command, exclude_metrics=()):
+    """
+    Отвечает на запросы веб-сервера о состоянии детектора.
+    Используется и в одном процессе, и через канал управления процесса детектора.
+    :param command: 'metrics', 'notifier_status', 'adaptive_status', 'recorder_status', 'collector_status' или 'health'.
+    :param exclude_metrics: Метрики, которые веб-сервер отдает сам (для 'metrics').
+    """
+    if command == 'metrics':
+        return metrics.REGISTRY.render(exclude=exclude_metrics)
+    if command == 'notifier_status':
+        return notification_outbox.stats() if notification_outbox is not None else None
+    if command == 'adaptive_status':
+        return {str(camera_id): pipeline.controller.status() if pipeline.controller is not None else None
+                for camera_id, pipeline in list(camera_pipelines.items())}
+    if command == 'health':
+        return health_status()
+    if command == 'collector_status':
+        return image_collector.stats() if image_collector is not None else None
+    if command == 'recorder_status':
+        return {str(camera_id): pipeline.recorder.stats() if pipeline.recorder is not None else None
+                for camera_id, pipeline in list(camera_pipelines.items())}
+    raise ValueError(f"Неизвестный запрос: {command}")
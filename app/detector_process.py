@@ -0,0 +1,100 @@
+# app/detector_process.py
+
+import itertools
+import multiprocessing
+import threading
+import time
+
+from frame_ring import FRAME_RING_SLOTS, FRAME_RING_SLOT_BYTES, SharedFrameRing
+
+DETECTOR_REQUEST_TIMEOUT = 2.0  # Сколько веб-сервер ждет ответа процесса детектора
+
+
+class DetectorProcess:
+    """
+    Детектор в отдельном процессе: YOLO, MOG2 и уведомления не делят GIL с Flask,
+    поэтому нагрузка от клиентов веб-стрима не снижает скорость детекции.
+    Кадры передаются через кольца SharedFrameRing (по одному на камеру),
+    а состояние (метрики, статусы) запрашивается по каналу управления multiprocessing.Pipe.
+    Процесс создается через fork до первого обращения к detector, поэтому модель YOLO
+    и CUDA инициализируются только в дочернем процессе.
+    """
+
+    def __init__(self, entry_point, args, camera_count, slots=FRAME_RING_SLOTS, slot_bytes=FRAME_RING_SLOT_BYTES):
+        """
+        :param entry_point: Имя функции модуля detector, запускающей обработку
+                            ('start_video_detection' или 'start_multi_camera_detection').
+        :param args: Аргументы этой функции.
+        :param camera_count: Число камер (по кольцу кадров на камеру).
+        """
+        self.entry_point = entry_point
+        self.args = args
+        self._context = multiprocessing.get_context('fork')
+        self.rings = [SharedFrameRing(slots, slot_bytes, cond=self._context.Condition())
+                      for _ in range(camera_count)]
+        self._conn, self._child_conn = self._context.Pipe()
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._process = self._context.Process(target=_run_detector,
+                                              args=(self._child_conn, self._conn, self.rings, entry_point, args),
+                                              name='detector', daemon=True)
+
+    def start(self):
+        self._process.start()
+        self._child_conn.close() # Конец канала остается только у дочернего процесса
+        print(f"[Detector Process] Процесс детектора запущен (pid {self._process.pid}), колец кадров: {len(self.rings)}.")
+        return self
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def request(self, command, timeout=DETECTOR_REQUEST_TIMEOUT, **kwargs):
+        """
+        Выполняет detector.handle_request в процессе детектора и возвращает результат.
+        Если процесс не ответил за timeout, возвращает None.
+        """
+        with self._lock:
+            if not self._process.is_alive():
+                return None
+            request_id = next(self._request_ids)
+            self._conn.send((request_id, command, kwargs))
+            while self._conn.poll(timeout):
+                reply_id, ok, result = self._conn.recv()
+                if reply_id != request_id:
+                    continue # Запоздавший ответ на запрос, по которому уже истек таймаут
+                if not ok:
+                    print(f"[Detector Process ERROR] Ошибка запроса {command}: {result}")
+                    return None
+                return result
+            print(f"[Detector Process ERROR] Процесс детектора не ответил на запрос {command} за {timeout} с.")
+            return None
+
+    def close(self):
+        """Останавливает процесс и удаляет кольца кадров. Можно вызывать повторно (например, явно и из atexit)."""
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(timeout=5)
+        for ring in self.rings:
+            ring.close()
+
+
+def _run_detector(conn, parent_conn, rings, entry_point, args):
+    """Точка входа дочернего процесса: запускает детектор и отвечает на запросы веб-сервера."""
+    parent_conn.close() # Иначе завершение веб-сервера не будет замечено (EOF на канале)
+    start_import_time = time.monotonic()
+    import detector # Модуль детектора и его зависимости импортируются только в процессе детектора
+    detector.startup_timings['detector_import_seconds'] = round(time.monotonic() - start_import_time, 3)
+
+    detector.frame_rings.update(enumerate(rings))
+    detection_thread = threading.Thread(target=getattr(detector, entry_point), args=args, daemon=True)
+    detection_thread.start()
+
+    while True:
+        try:
+            request_id, command, kwargs = conn.recv()
+        except (EOFError, OSError):
+            break # Веб-сервер завершился
+        try:
+            conn.send((request_id, True, detector.handle_request(command, **kwargs)))
+        except Exception as e:
+            conn.send((request_id, False, str(e)))
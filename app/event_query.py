@@ -0,0 +1,73 @@
+# app/event_query.py
+"""
+Чтение индекса событий для веб-сервера. Модуль не регистрирует метрики: метрики индекса
+считает процесс детектора (event_store), и веб-сервер отдает их значения из детектора.
+"""
+
+import os
+import sqlite3
+
+EVENT_STORE_PATH = os.path.join('shared_data', 'events.db') # База SQLite (пишет детектор, читает веб-сервер)
+EVENT_QUERY_MAX_LIMIT = 200
+
+
+def connect(db_path):
+    """Открывает базу индекса в режиме WAL: читатели (веб-сервер) не блокируют запись детектора."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def query_events(db_path, classes=None, start_time=None, end_time=None, camera=None, limit=50, offset=0):
+    """
+    Поиск событий для API: новые события первыми.
+    :param classes: Список классов: событие подходит, если в нем есть хотя бы один из них.
+    :param start_time: Начало интервала (секунды Unix, включительно).
+    :param end_time: Конец интервала (секунды Unix, не включительно).
+    :return: {'events': [...], 'total': число подходящих событий, 'limit': ..., 'offset': ...}
+    """
+    limit = max(1, min(EVENT_QUERY_MAX_LIMIT, int(limit)))
+    offset = max(0, int(offset))
+    conditions, params = [], []
+    if classes:
+        conditions.append(f"id IN (SELECT event_id FROM detections WHERE class IN ({', '.join('?' * len(classes))}))")
+        params.extend(classes)
+    if start_time is not None:
+        conditions.append('time >= ?')
+        params.append(start_time)
+    if end_time is not None:
+        conditions.append('time < ?')
+        params.append(end_time)
+    if camera is not None:
+        conditions.append('camera = ?')
+        params.append(camera)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    if not os.path.exists(db_path):
+        return {'events': [], 'total': 0, 'limit': limit, 'offset': offset} # Детектор еще не создал индекс
+    conn = connect(db_path)
+    try:
+        total = conn.execute(f'SELECT COUNT(*) FROM events {where}', params).fetchone()[0]
+        rows = conn.execute(f'SELECT id, time, camera, motion_area, classes, photo_path, clip_path, collected_path '
+                            f'FROM events {where} ORDER BY time DESC, id DESC LIMIT ? OFFSET ?',
+                            params + [limit, offset]).fetchall()
+        events = []
+        for event_id, event_time, event_camera, motion_area, classes_text, photo_path, clip_path, collected_path in rows:
+            detections = conn.execute('SELECT class, confidence FROM detections WHERE event_id = ? ORDER BY confidence DESC',
+                                      (event_id,)).fetchall()
+            events.append({
+                'id': event_id,
+                'time': event_time,
+                'camera': event_camera,
+                'motion_area': motion_area,
+                'classes': classes_text.split(',') if classes_text else [],
+                'detections': [{'class': name, 'confidence': conf} for name, conf in detections],
+                'photo_path': photo_path,
+                'clip_path': clip_path,
+                'collected_path': collected_path,
+            })
+    finally:
+        conn.close()
+    return {'events': events, 'total': total, 'limit': limit, 'offset': offset}
@@ -0,0 +1,224 @@
+# app/event_recorder.py
+
+import collections
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+import metrics
+
+# --- Параметры записи клипов событий ---
+CLIP_PRE_ROLL_SECONDS = 5.0      # Сколько секунд до события попадает в клип
+CLIP_POST_ROLL_SECONDS = 5.0     # Сколько секунд после последнего срабатывания записывается
+CLIP_MAX_SECONDS = 60.0          # Максимальная длительность клипа: длинное событие делится на несколько
+CLIP_BUFFER_MAX_BYTES = 64 * 1024 * 1024  # Предел памяти кольца закодированных кадров
+CLIP_JPEG_QUALITY = 80
+CLIP_PENDING_FRAMES = 50         # Очередь кадров на кодирование: при перегрузке старые кадры пропускаются
+CLIP_FOURCC = 'mp4v'
+
+EVENT_CLIPS_TOTAL = metrics.Counter('event_clips_total', 'Записанные клипы событий (written, failed)', ['camera', 'result'])
+EVENT_CLIP_BUFFER_BYTES = metrics.Gauge('event_clip_buffer_bytes', 'Объем кольца закодированных кадров для клипов', ['camera'])
+
+
+class _ClipEvent:
+    """Событие, для которого собираются кадры клипа."""
+
+    def __init__(self, path, start_time, end_time):
+        self.path = path
+        self.start_time = start_time
+        self.end_time = end_time
+        self.frames = [] # [(время кадра, JPEG)]
+        self.triggers = 1
+
+
+class EventRecorder:
+    """
+    Запись клипов событий с пред- и пост-записью.
+    Последние pre_roll_seconds секунд кадров хранятся в памяти в виде JPEG (кольцо с ограничением по объему).
+    По срабатыванию trigger() клип охватывает пред-запись, само событие и post_roll_seconds после
+    последнего срабатывания: пересекающиеся события объединяются в один клип.
+    Кодирование кадров и запись файлов выполняются в фоновых потоках, add_frame() и trigger()
+    не блокируют конвейер. Файл появляется под итоговым именем только после полной записи.
+    """
+
+    def __init__(self, output_folder, file_prefix='', camera='0',
+                 pre_roll_seconds=CLIP_PRE_ROLL_SECONDS, post_roll_seconds=CLIP_POST_ROLL_SECONDS,
+                 max_clip_seconds=CLIP_MAX_SECONDS, max_buffer_bytes=CLIP_BUFFER_MAX_BYTES,
+                 jpeg_quality=CLIP_JPEG_QUALITY):
+        """
+        :param output_folder: Папка для файлов клипов.
+        :param file_prefix: Префикс имени файла (например, номер камеры).
+        :param camera: Метка камеры для метрик.
+        :param pre_roll_seconds: Длительность пред-записи.
+        :param post_roll_seconds: Длительность пост-записи после последнего срабатывания.
+        :param max_clip_seconds: Максимальная длительность одного клипа.
+        :param max_buffer_bytes: Предел памяти кольца пред-записи.
+        """
+        self.output_folder = output_folder
+        self.file_prefix = file_prefix
+        self.pre_roll_seconds = pre_roll_seconds
+        self.post_roll_seconds = post_roll_seconds
+        self.max_clip_seconds = max_clip_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self.jpeg_quality = jpeg_quality
+
+        self._ring = collections.deque() # [(время кадра, JPEG)]
+        self._ring_bytes = 0
+        self._pending = collections.deque(maxlen=CLIP_PENDING_FRAMES)
+        self._cond = threading.Condition()
+        self._event = None
+        self._write_queue = queue.Queue()
+
+        self.frames_dropped = 0
+        self.events_merged = 0
+        self.clips_written = 0
+        self.clips_failed = 0
+        self._written_metric = EVENT_CLIPS_TOTAL.labels(camera=camera, result='written')
+        self._failed_metric = EVENT_CLIPS_TOTAL.labels(camera=camera, result='failed')
+        EVENT_CLIP_BUFFER_BYTES.labels(camera=camera).set_function(lambda: self._ring_bytes)
+
+    def start(self):
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        print(f"[Event Recorder] Запись клипов запущена: пред-запись {self.pre_roll_seconds} с, "
+              f"пост-запись {self.post_roll_seconds} с, папка {self.output_folder}")
+        return self
+
+    def add_frame(self, frame, timestamp):
+        """
+        Передает кадр в кольцо пред-записи. Кадр не должен изменяться после вызова.
+        :param timestamp: Время кадра (секунды; то же время, что передается в trigger).
+        """
+        with self._cond:
+            if len(self._pending) == self._pending.maxlen:
+                self.frames_dropped += 1 # deque с maxlen сам вытеснит самый старый кадр
+            self._pending.append((timestamp, frame))
+            self._cond.notify()
+
+    def trigger(self, timestamp, timestamp_label):
+        """
+        Отмечает срабатывание в момент timestamp.
+        Если клип текущего события еще записывается, событие продлевается, иначе начинается новое.
+        :param timestamp_label: Строка времени для имени нового файла.
+        :return: Путь, по которому появится клип.
+        """
+        with self._cond:
+            event = self._event
+            if (event is not None and timestamp <= event.end_time and
+                    timestamp + self.post_roll_seconds - event.start_time <= self.max_clip_seconds):
+                event.end_time = max(event.end_time, timestamp + self.post_roll_seconds)
+                event.triggers += 1
+                self.events_merged += 1
+                return event.path
+
+            if event is not None:
+                self._finish_event() # Событие достигло максимальной длительности: начинаем следующий клип
+            path = os.path.join(self.output_folder, f"clip_{self.file_prefix}{timestamp_label}.mp4")
+            event = _ClipEvent(path, timestamp - self.pre_roll_seconds, timestamp + self.post_roll_seconds)
+            event.frames = [item for item in self._ring if item[0] >= event.start_time]
+            self._event = event
+            return path
+
+    def flush(self):
+        """Завершает текущее событие после кодирования уже переданных кадров (конец видео, остановка)."""
+        with self._cond:
+            self._pending.append((None, None))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'buffer_frames': len(self._ring), 'buffer_bytes': self._ring_bytes,
+                    'recording': self._event.path if self._event is not None else None,
+                    'frames_dropped': self.frames_dropped, 'events_merged': self.events_merged,
+                    'clips_written': self.clips_written, 'clips_failed': self.clips_failed}
+
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) > 0)
+                timestamp, frame = self._pending.popleft()
+                if frame is None:
+                    if self._event is not None:
+                        self._finish_event()
+                    continue
+
+            ret, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+            if not ret:
+                print("[Event Recorder ERROR] Ошибка кодирования кадра в JPEG.")
+                continue
+            item = (timestamp, buffer.tobytes())
+
+            with self._cond:
+                self._ring.append(item)
+                self._ring_bytes += len(item[1])
+                # Кольцо ограничено длительностью пред-записи и объемом памяти
+                while self._ring and (self._ring[0][0] < timestamp - self.pre_roll_seconds or
+                                      self._ring_bytes > self.max_buffer_bytes):
+                    _, old = self._ring.popleft()
+                    self._ring_bytes -= len(old)
+
+                event = self._event
+                if event is not None:
+                    if timestamp > event.end_time:
+                        self._finish_event()
+                    elif timestamp >= event.start_time:
+                        event.frames.append(item)
+
+    def _finish_event(self):
+        """Передает собранное событие фоновому писателю. Вызывается под self._cond."""
+        event = self._event
+        self._event = None
+        if event.frames:
+            self._write_queue.put(event)
+
+    def _write_loop(self):
+        while True:
+            event = self._write_queue.get()
+            if self._write_clip(event):
+                with self._cond:
+                    self.clips_written += 1
+                self._written_metric.inc()
+                print(f"[Event Recorder] Клип записан: {event.path} ({len(event.frames)} кадров, срабатываний: {event.triggers})")
+            else:
+                with self._cond:
+                    self.clips_failed += 1
+                self._failed_metric.inc()
+
+    def _write_clip(self, event):
+        frames = event.frames
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+        fps = max(1.0, min(60.0, fps))
+
+        first = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+        if first is None:
+            print(f"[Event Recorder ERROR] Не удалось декодировать кадры клипа: {event.path}")
+            return False
+        height, width = first.shape[:2]
+        # Файл пишется под временным именем, чтобы получатели не увидели недописанный клип
+        root, ext = os.path.splitext(event.path)
+        temp_path = f"{root}.part{ext}"
+        writer = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*CLIP_FOURCC), fps, (width, height))
+        if not writer.isOpened():
+            print(f"[Event Recorder ERROR] Не удалось создать файл клипа: {temp_path}")
+            return False
+        try:
+            for _, jpeg in frames:
+                image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is None:
+                    continue
+                if image.shape[:2] != (height, width):
+                    # Регулятор мог сменить разрешение обработки посреди события
+                    image = cv2.resize(image, (width, height))
+                writer.write(image)
+        finally:
+            writer.release()
+        try:
+            os.replace(temp_path, event.path)
+        except OSError as e:
+            print(f"[Event Recorder ERROR] Не удалось сохранить клип {event.path}: {e}")
+            return False
+        return True
@@ -0,0 +1,231 @@
+# app/event_store.py
+
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from event_query import connect
+
+# --- Параметры индекса событий ---
+EVENT_FLUSH_INTERVAL_SECONDS = 1.0     # Как часто записывать накопленные события одной транзакцией
+EVENT_BATCH_SIZE = 100                 # Запись без ожидания, если накопилось столько событий
+EVENT_RETENTION_DAYS = 7               # События старше удаляются вместе с файлами
+EVENT_MAX_TOTAL_BYTES = 2 * 1024 ** 3  # Предел суммарного размера файлов событий
+EVENT_EVICTION_INTERVAL_SECONDS = 60.0 # Как часто проверять хранение
+EVENT_SETTLE_SECONDS = 120.0           # Через сколько секунд файлы события считаются дописанными (клип, снимок)
+
+EVENTS_INDEXED_TOTAL = metrics.Counter('event_store_indexed_total', 'Число событий, записанных в индекс')
+EVENTS_EVICTED_TOTAL = metrics.Counter('event_store_evicted_total', 'Число удаленных событий (age, size)', ['reason'])
+EVENT_STORE_BYTES = metrics.Gauge('event_store_bytes', 'Суммарный размер файлов проиндексированных событий')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    camera INTEGER NOT NULL,
+    motion_area INTEGER NOT NULL,
+    classes TEXT NOT NULL,
+    photo_path TEXT,
+    clip_path TEXT,
+    collected_path TEXT,
+    bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_clip ON events (clip_path);
+CREATE TABLE IF NOT EXISTS detections (
+    event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+    class TEXT NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_class ON detections (class, event_id);
+CREATE INDEX IF NOT EXISTS detections_event ON detections (event_id);
+"""
+
+# Файлы, которыми владеет индекс. Кадры для разметки (collected_path) - часть набора данных
+# со своим индексом в сборщике, поэтому хранение событий их не учитывает и не удаляет.
+_FILE_COLUMNS = ('photo_path', 'clip_path')
+
+
+class EventStore:
+    """
+    Встроенный индекс событий детектора на SQLite.
+    add_event() только ставит событие в буфер: запись выполняется фоновым потоком пачками
+    в одной транзакции. Более поздние детекции открытого клипа дописываются в его событие
+    через merge_clip_detections(). Второй фоновый поток соблюдает хранение: удаляет события старше
+    max_age_seconds и самые старые события, пока суммарный размер их файлов больше max_total_bytes.
+    Файлы, на которые ссылаются оставшиеся события (общий клип объединенного события), не удаляются.
+    """
+
+    def __init__(self, db_path, max_age_seconds=EVENT_RETENTION_DAYS * 86400, max_total_bytes=EVENT_MAX_TOTAL_BYTES,
+                 flush_interval=EVENT_FLUSH_INTERVAL_SECONDS, eviction_interval=EVENT_EVICTION_INTERVAL_SECONDS):
+        """
+        :param db_path: Путь к файлу базы.
+        :param max_age_seconds: Максимальный возраст события.
+        :param max_total_bytes: Предел суммарного размера файлов событий.
+        :param flush_interval: Период записи накопленных событий.
+        :param eviction_interval: Период проверки хранения.
+        """
+        self.db_path = db_path
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = max_total_bytes
+        self.flush_interval = flush_interval
+        self.eviction_interval = eviction_interval
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(db_path) as conn:
+            conn.executescript(_SCHEMA)
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self.total_bytes = 0
+        EVENT_STORE_BYTES.set_function(lambda: self.total_bytes)
+
+    def start(self):
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        threading.Thread(target=self._eviction_loop, daemon=True).start()
+        print(f"[Event Store] Индекс событий: {self.db_path} (хранение {self.max_age_seconds / 86400:g} дн., "
+              f"до {self.max_total_bytes / 1024 ** 2:.0f} МБ)")
+        return self
+
+    def add_event(self, event_time, camera, motion_area, detections, photo_path=None, clip_path=None, collected_path=None):
+        """
+        Ставит событие в очередь на запись. Не обращается к диску.
+        :param event_time: Время события (секунды Unix).
+        :param motion_area: Суммарная площадь областей движения в пикселях обрабатываемого кадра.
+        :param detections: Детекции (x1, y1, x2, y2, conf, name).
+        """
+        classes = sorted({detection[5] for detection in detections})
+        event = (event_time, camera, int(motion_area), ",".join(classes), photo_path, clip_path, collected_path,
+                 [(detection[5], float(detection[4])) for detection in detections])
+        self._enqueue(('add', event))
+
+    def merge_clip_detections(self, clip_path, detections):
+        """
+        Дополняет последнее событие клипа детекциями более поздних срабатываний того же клипа:
+        новые классы добавляются, для известных сохраняется наибольшая уверенность.
+        :param detections: Пары (класс, уверенность).
+        """
+        self._enqueue(('merge', clip_path, [(name, float(conf)) for name, conf in detections]))
+
+    def _enqueue(self, item):
+        with self._cond:
+            self._pending.append(item)
+            if len(self._pending) >= EVENT_BATCH_SIZE:
+                self._cond.notify()
+
+    def _flush_loop(self):
+        conn = connect(self.db_path)
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= EVENT_BATCH_SIZE, self.flush_interval)
+                batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                # Порядок очереди сохраняется: дополнение клипа применяется после записи его события
+                with conn:
+                    for item in batch:
+                        if item[0] == 'add':
+                            event = item[1]
+                            cursor = conn.execute(
+                                'INSERT INTO events (time, camera, motion_area, classes, photo_path, clip_path, collected_path) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)', event[:7])
+                            conn.executemany('INSERT INTO detections (event_id, class, confidence) VALUES (?, ?, ?)',
+                                             [(cursor.lastrowid, name, conf) for name, conf in event[7]])
+                        else:
+                            self._merge(conn, item[1], item[2])
+                EVENTS_INDEXED_TOTAL.inc(sum(1 for item in batch if item[0] == 'add'))
+            except sqlite3.Error as e:
+                print(f"[Event Store ERROR] Не удалось записать {len(batch)} событий: {e}")
+
+    @staticmethod
+    def _merge(conn, clip_path, detections):
+        row = conn.execute('SELECT id FROM events WHERE clip_path = ? ORDER BY id DESC LIMIT 1', (clip_path,)).fetchone()
+        if row is None:
+            return # Событие клипа уже удалено хранением
+        event_id = row[0]
+        for name, conf in detections:
+            existing = conn.execute('SELECT MAX(confidence) FROM detections WHERE event_id = ? AND class = ?',
+                                    (event_id, name)).fetchone()[0]
+            if existing is None:
+                conn.execute('INSERT INTO detections (event_id, class, confidence) VALUES (?, ?, ?)', (event_id, name, conf))
+            elif conf > existing:
+                conn.execute('UPDATE detections SET confidence = ? WHERE event_id = ? AND class = ? AND confidence = ?',
+                             (conf, event_id, name, existing))
+        classes = sorted(name for name, in conn.execute('SELECT DISTINCT class FROM detections WHERE event_id = ?', (event_id,)))
+        conn.execute('UPDATE events SET classes = ? WHERE id = ?', (",".join(classes), event_id))
+
+    def _eviction_loop(self):
+        conn = connect(self.db_path)
+        while True:
+            try:
+                self._settle_sizes(conn)
+                self._evict(conn)
+            except sqlite3.Error as e:
+                print(f"[Event Store ERROR] Ошибка при очистке индекса: {e}")
+            time.sleep(self.eviction_interval)
+
+    def _settle_sizes(self, conn):
+        """Записывает размер файлов событий, которые уже дописаны. Общий клип учитывается один раз."""
+        rows = conn.execute('SELECT id, photo_path, clip_path FROM events '
+                            'WHERE bytes IS NULL AND time < ? ORDER BY id', (time.time() - EVENT_SETTLE_SECONDS,)).fetchall()
+        with conn:
+            for event_id, photo_path, clip_path in rows:
+                size = _file_size(photo_path)
+                if clip_path and conn.execute('SELECT 1 FROM events WHERE clip_path = ? AND id < ? LIMIT 1',
+                                              (clip_path, event_id)).fetchone() is None:
+                    size += _file_size(clip_path)
+                conn.execute('UPDATE events SET bytes = ? WHERE id = ?', (size, event_id))
+
+    def _evict(self, conn):
+        expired = conn.execute('SELECT id FROM events WHERE time < ? ORDER BY time',
+                               (time.time() - self.max_age_seconds,)).fetchall()
+        if expired:
+            self._delete_events(conn, [row[0] for row in expired], 'age')
+
+        total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM events').fetchone()[0]
+        if total > self.max_total_bytes:
+            victims = []
+            excess = total - self.max_total_bytes
+            for event_id, size in conn.execute('SELECT id, COALESCE(bytes, 0) FROM events ORDER BY time, id'):
+                if excess <= 0:
+                    break
+                victims.append(event_id)
+                excess -= size
+            self._delete_events(conn, victims, 'size')
+            total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM events').fetchone()[0]
+        self.total_bytes = total
+
+    def _delete_events(self, conn, event_ids, reason):
+        files = set()
+        with conn:
+            for event_id in event_ids:
+                row = conn.execute(f"SELECT {', '.join(_FILE_COLUMNS)} FROM events WHERE id = ?", (event_id,)).fetchone()
+                conn.execute('DELETE FROM events WHERE id = ?', (event_id,))
+                files.update(path for path in row if path)
+        still_used = 'SELECT 1 FROM events WHERE ' + ' OR '.join(f'{column} = ?' for column in _FILE_COLUMNS) + ' LIMIT 1'
+        for path in files:
+            # Файл может принадлежать и событию, которое остается (клип объединенного события)
+            if conn.execute(still_used, (path,) * len(_FILE_COLUMNS)).fetchone():
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[Event Store ERROR] Не удалось удалить файл {path}: {e}")
+        EVENTS_EVICTED_TOTAL.labels(reason=reason).inc(len(event_ids))
+        print(f"[Event Store] Удалено событий ({reason}): {len(event_ids)}, файлов: {len(files)}")
+
+
+def _file_size(path):
+    if not path:
+        return 0
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
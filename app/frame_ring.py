@@ -0,0 +1,176 @@
+# app/frame_ring.py
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# --- Параметры кольцевого буфера кадров ---
+FRAME_RING_SLOTS = 8                     # Число кадров в кольце: столько кадров читатель может отставать от записи
+FRAME_RING_SLOT_BYTES = 960 * 540 * 3    # Максимальный размер кадра (по умолчанию до 960x540 BGR)
+FRAME_RING_POLL_SECONDS = 0.005          # Период опроса, если нет межпроцессной условной переменной
+
+_HEADER_FIELDS = 4   # latest_seq, slots, slot_bytes, зарезервировано
+_SLOT_FIELDS = 5     # seq, height, width, channels, timestamp_ns
+_ALIGNMENT = 64
+
+
+def _data_offset(slots):
+    offset = (_HEADER_FIELDS + slots * _SLOT_FIELDS) * 8
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedFrameRing:
+    """
+    Кольцевой буфер кадров в multiprocessing.shared_memory.
+    Процесс детектора пишет кадры через publish(), процессы-читатели (веб-сервер, запись, сбор)
+    получают numpy-представление кадра прямо в разделяемой памяти, без копирования.
+    Каждый кадр получает порядковый номер seq и пишется в слот seq % slots.
+    Слот помечается недействительным на время записи, поэтому читатель, который держит кадр дольше,
+    чем занимает запись slots кадров, может проверить его через is_valid(seq) и отбросить.
+    """
+
+    def __init__(self, slots=FRAME_RING_SLOTS, slot_bytes=FRAME_RING_SLOT_BYTES, name=None, create=True, cond=None):
+        """
+        :param slots: Число слотов кольца.
+        :param slot_bytes: Максимальный размер одного кадра в байтах.
+        :param name: Имя сегмента разделяемой памяти (None - сгенерировать при создании).
+        :param create: True - создать сегмент, False - подключиться к существующему (см. attach).
+        :param cond: multiprocessing.Condition для пробуждения читателей (None - читатели опрашивают seq).
+        """
+        if create:
+            size = _data_offset(slots) + slots * slot_bytes
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=self._shm.buf)
+            self._header[:] = (0, slots, slot_bytes, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=self._shm.buf)
+            slots, slot_bytes = int(self._header[1]), int(self._header[2])
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.cond = cond
+        self._owner = create
+        self._meta = np.ndarray((slots, _SLOT_FIELDS), dtype=np.int64, buffer=self._shm.buf,
+                                offset=_HEADER_FIELDS * 8)
+        if create:
+            self._meta[:] = 0
+        self._data_offset = _data_offset(slots)
+        self._oversize_reported = False
+        self._closed = False
+
+    @classmethod
+    def attach(cls, name, cond=None):
+        """Подключается к кольцу, созданному другим процессом."""
+        return cls(name=name, create=False, cond=cond)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def seq(self):
+        return int(self._header[0])
+
+    def publish(self, frame):
+        """Записывает кадр в следующий слот и будит читателей. Единственная копия кадра - в разделяемую память."""
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            if not self._oversize_reported:
+                print(f"[Frame Ring ERROR] Кадр {frame.shape} {frame.dtype} не помещается в слот {self.slot_bytes} байт, кадры пропускаются.")
+                self._oversize_reported = True
+            return
+        seq = self.seq + 1
+        slot = seq % self.slots
+        self._meta[slot, 0] = 0 # Слот недействителен на время записи
+        np.copyto(self._slot_view(slot, frame.shape), frame)
+        channels = frame.shape[2] if frame.ndim == 3 else 0
+        self._meta[slot, 1:] = (frame.shape[0], frame.shape[1], channels, time.time_ns())
+        self._meta[slot, 0] = seq
+        self._header[0] = seq
+        if self.cond is not None:
+            with self.cond:
+                self.cond.notify_all()
+
+    def read(self, seq=None):
+        """
+        Возвращает (seq, кадр) без копирования: кадр - представление только для чтения в разделяемой памяти.
+        :param seq: Номер кадра (None - последний). Если кадр уже перезаписан, возвращается (seq, None).
+        """
+        if seq is None:
+            seq = self.seq
+        if seq <= 0:
+            return seq, None
+        slot = seq % self.slots
+        if self._meta[slot, 0] != seq:
+            return seq, None
+        height, width, channels = (int(value) for value in self._meta[slot, 1:4])
+        frame = self._slot_view(slot, (height, width, channels) if channels else (height, width))
+        frame.flags.writeable = False
+        if not self.is_valid(seq):
+            return seq, None # Слот начали перезаписывать, пока читались размеры
+        return seq, frame
+
+    def frame_time(self, seq):
+        """Время записи кадра (секунды Unix) или None, если кадр уже перезаписан."""
+        slot = seq % self.slots
+        timestamp_ns = int(self._meta[slot, 4])
+        return timestamp_ns / 1e9 if self.is_valid(seq) else None
+
+    def is_valid(self, seq):
+        """Проверяет, что кадр seq еще не перезаписан (вызывать после работы с полученным представлением)."""
+        return seq > 0 and int(self._meta[seq % self.slots, 0]) == seq
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Блокируется до появления кадра с seq > last_seq или до истечения timeout.
+        Возвращает (seq, кадр); если нового кадра нет, seq == last_seq и кадр None.
+        """
+        if self.seq <= last_seq:
+            if self.cond is not None:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.seq > last_seq, timeout)
+            else:
+                deadline = time.monotonic() + timeout
+                while self.seq <= last_seq and time.monotonic() < deadline:
+                    time.sleep(FRAME_RING_POLL_SECONDS)
+        if self.seq <= last_seq:
+            return last_seq, None
+        return self.read()
+
+    def close(self):
+        """Отключается от сегмента. Создатель кольца также удаляет сегмент. Повторный вызов ничего не делает."""
+        if self._closed:
+            return
+        # Представления numpy держат ссылку на буфер и мешают закрытию сегмента
+        self._header = None
+        self._meta = None
+        try:
+            self._shm.close()
+        except BufferError:
+            print(f"[Frame Ring ERROR] Кольцо {self._shm.name} еще используется и не может быть закрыто.")
+            return
+        self._closed = True
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass # Сегмент уже удален (например, при завершении процесса)
+
+    def _slot_view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf,
+                          offset=self._data_offset + slot * self.slot_bytes)
+
+
+def feed_stream_hub(ring, hub, stop_event=None, timeout=1.0):
+    """
+    Переносит кадры из кольца в хаб веб-стриминга в процессе веб-сервера.
+    Хаб получает представления кадров без копирования вместе с их seq,
+    а перезаписанные за время кодирования кадры отбрасывает по ring.is_valid.
+    """
+    last_seq = 0
+    while stop_event is None or not stop_event.is_set():
+        seq, frame = ring.wait_for_frame(last_seq, timeout)
+        if frame is None:
+            continue
+        hub.publish(frame, seq=seq)
+        last_seq = seq
@@ -0,0 +1,239 @@
+# app/image_collector.py
+
+import datetime
+import os
+import queue
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+import metrics
+from event_query import connect
+
+# --- Параметры сбора изображений для разметки ---
+COLLECT_IMAGE_INTERVAL_SECONDS = 60   # Базовый интервал: кадр с движением сохраняется не реже этого
+COLLECT_MIN_INTERVAL_SECONDS = 5      # Минимальный интервал между кадрами одной камеры (кроме новых классов)
+COLLECT_LOW_CONFIDENCE = 0.6          # Детекции с уверенностью ниже - трудные примеры, их стоит разметить
+COLLECT_TIME_BUCKET_HOURS = 3         # Сутки делятся на интервалы для разнообразия по времени суток
+COLLECT_TIME_BUCKET_MIN_IMAGES = 100  # Интервал суток с меньшим числом кадров считается недопредставленным
+COLLECT_HASH_DISTANCE = 6             # Кадр с перцептивным хешем ближе этого (бит из 64) считается дубликатом
+COLLECT_WRITERS = 2                   # Потоки записи файлов
+COLLECT_QUEUE_SIZE = 16               # Очередь на запись: при переполнении кадр пропускается
+COLLECT_JPEG_QUALITY = 95
+
+COLLECTED_IMAGES_TOTAL = metrics.Counter('collector_images_total',
+                                         'Кадры для разметки (saved, duplicate, dropped, failed)', ['result'])
+COLLECTOR_INDEX_SIZE = metrics.Gauge('collector_index_images', 'Число изображений в индексе собранных кадров')
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    phash TEXT NOT NULL,
+    time REAL NOT NULL,
+    camera INTEGER NOT NULL,
+    classes TEXT NOT NULL,
+    reasons TEXT NOT NULL
+);
+"""
+
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def perceptual_hash(frame):
+    """64-битный pHash: знаки низких частот DCT уменьшенного кадра в оттенках серого."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:]) # Постоянная составляющая не учитывается в медиане
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def yolo_labels(detections, class_ids, frame_width, frame_height):
+    """Строки разметки YOLO (class cx cy w h, нормированные) из текущих детекций."""
+    lines = []
+    for x1, y1, x2, y2, _, name in detections:
+        if name not in class_ids:
+            continue
+        x1, x2 = max(0, x1), min(frame_width, x2)
+        y1, y2 = max(0, y1), min(frame_height, y2)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        lines.append(f"{class_ids[name]} {(x1 + x2) / 2 / frame_width:.6f} {(y1 + y2) / 2 / frame_height:.6f} "
+                     f"{(x2 - x1) / frame_width:.6f} {(y2 - y1) / frame_height:.6f}")
+    return lines
+
+
+class ImageCollector:
+    """
+    Сбор кадров для дообучения модели (training/custom_dataset).
+    offer() решает на потоке камеры, стоит ли сохранять кадр: новый для набора класс, неуверенные
+    детекции, недопредставленное время суток или базовый интервал. Близкие по перцептивному хешу
+    кадры (в том числе собранные в прошлых запусках, индекс хранится в SQLite) пропускаются.
+    JPEG и заготовка разметки YOLO (labels/*.txt из текущих детекций) пишутся пулом фоновых потоков,
+    поэтому конвейер камеры не ждет диска.
+    """
+
+    def __init__(self, base_folder, run_folder, names, interval_seconds=COLLECT_IMAGE_INTERVAL_SECONDS,
+                 min_interval_seconds=COLLECT_MIN_INTERVAL_SECONDS, hash_distance=COLLECT_HASH_DISTANCE,
+                 writers=COLLECT_WRITERS, max_queue=COLLECT_QUEUE_SIZE):
+        """
+        :param base_folder: Корень собранных кадров, в нем лежит индекс index.db.
+        :param run_folder: Папка текущего запуска (images/ и labels/ внутри).
+        :param names: Функция, возвращающая классы модели {id: имя} (вызывается при первой записи).
+        :param interval_seconds: Базовый интервал сохранения для камеры.
+        :param min_interval_seconds: Минимальный интервал между кадрами камеры.
+        :param hash_distance: Порог расстояния Хэмминга для дубликатов.
+        :param writers: Число потоков записи.
+        :param max_queue: Глубина очереди на запись.
+        """
+        self.base_folder = base_folder
+        self.run_folder = run_folder
+        self.names = names
+        self.interval_seconds = interval_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.hash_distance = hash_distance
+        self.writers = writers
+        self.index_path = os.path.join(base_folder, 'index.db')
+
+        self._images_folder = os.path.join(run_folder, 'images')
+        self._labels_folder = os.path.join(run_folder, 'labels')
+        os.makedirs(self._images_folder, exist_ok=True)
+        os.makedirs(self._labels_folder, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._class_ids = None
+        self._last_times = {}      # Камера -> (время последнего кадра, время последнего кадра по базовому интервалу)
+        self._sequence = 0
+        self.reasons = {}
+        self.saved = self.duplicates = self.dropped = self.failed = 0
+
+        # Индекс прошлых запусков: хеши для поиска дубликатов, классы и распределение по времени суток
+        with connect(self.index_path) as conn:
+            conn.executescript(_INDEX_SCHEMA)
+            rows = conn.execute('SELECT phash, time, classes FROM images').fetchall()
+        self._hashes = np.array([int(phash, 16) for phash, _, _ in rows], dtype=np.uint64)
+        self._classes = {name for _, _, classes in rows for name in classes.split(',') if name}
+        self._time_buckets = [0] * (24 // COLLECT_TIME_BUCKET_HOURS)
+        for _, image_time, _ in rows:
+            self._time_buckets[self._time_bucket(image_time)] += 1
+        COLLECTOR_INDEX_SIZE.set_function(lambda: len(self._hashes))
+
+    def start(self):
+        for _ in range(self.writers):
+            threading.Thread(target=self._writer, daemon=True).start()
+        print(f"[Image Collector] Сбор кадров в {self.run_folder} (в индексе {len(self._hashes)} кадров, "
+              f"классов: {len(self._classes)}).")
+        return self
+
+    def offer(self, frame, detections, camera, timestamp):
+        """
+        Предлагает кадр с движением. Не обращается к диску.
+        :param frame: Неразмеченный кадр (не должен изменяться после вызова).
+        :param detections: Текущие детекции (x1, y1, x2, y2, conf, name) в координатах кадра.
+        :param timestamp: Время кадра для интервалов (по часам или по видео при воспроизведении).
+        :return: Путь, по которому будет сохранен кадр, или None, если кадр не нужен.
+        """
+        now = datetime.datetime.now()
+        with self._lock:
+            last_time, last_interval_time = self._last_times.get(camera, (None, None))
+            reasons = []
+            new_classes = {detection[5] for detection in detections} - self._classes
+            if new_classes:
+                reasons.append('new_class')
+            elif last_time is not None and timestamp - last_time < self.min_interval_seconds:
+                return None
+            if any(detection[4] < COLLECT_LOW_CONFIDENCE for detection in detections):
+                reasons.append('low_confidence')
+            if self._time_buckets[self._time_bucket(now.timestamp())] < COLLECT_TIME_BUCKET_MIN_IMAGES:
+                reasons.append('time_of_day')
+            if last_interval_time is None or timestamp - last_interval_time >= self.interval_seconds:
+                reasons.append('interval')
+            if not reasons:
+                return None
+
+            # Дубликаты пропускаются, если в кадре нет нового для набора класса
+            phash = perceptual_hash(frame)
+            if not new_classes and len(self._hashes) and self._nearest_distance(phash) <= self.hash_distance:
+                self.duplicates += 1
+                COLLECTED_IMAGES_TOTAL.labels(result='duplicate').inc()
+                return None
+
+            self._sequence += 1
+            filename = f"cam{camera}_{now.strftime('%Y%m%d-%H%M%S')}_{self._sequence:05d}"
+            path = os.path.join(self._images_folder, filename + '.jpg')
+            try:
+                self._queue.put_nowait((frame, list(detections), camera, now.timestamp(), phash, reasons, path, filename))
+            except queue.Full:
+                self.dropped += 1
+                COLLECTED_IMAGES_TOTAL.labels(result='dropped').inc()
+                return None
+
+            # Индекс в памяти обновляется сразу, чтобы следующие кадры сравнивались и с этим
+            self._hashes = np.append(self._hashes, np.uint64(phash))
+            self._classes.update(new_classes)
+            self._time_buckets[self._time_bucket(now.timestamp())] += 1
+            self._last_times[camera] = (timestamp, timestamp if 'interval' in reasons else last_interval_time)
+            for reason in reasons:
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'run_folder': self.run_folder,
+                'indexed': len(self._hashes),
+                'classes': sorted(self._classes),
+                'time_buckets': list(self._time_buckets),
+                'queue': self._queue.qsize(),
+                'saved': self.saved,
+                'duplicates': self.duplicates,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'reasons': dict(self.reasons),
+            }
+
+    def _nearest_distance(self, phash):
+        difference = np.bitwise_xor(self._hashes, np.uint64(phash))
+        return int(_POPCOUNT[difference.view(np.uint8)].reshape(-1, 8).sum(axis=1).min())
+
+    @staticmethod
+    def _time_bucket(unix_time):
+        return datetime.datetime.fromtimestamp(unix_time).hour // COLLECT_TIME_BUCKET_HOURS
+
+    def _writer(self):
+        conn = connect(self.index_path)
+        while True:
+            frame, detections, camera, image_time, phash, reasons, path, filename = self._queue.get()
+            if not cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, COLLECT_JPEG_QUALITY]):
+                print(f"[Image Collector ERROR] Не удалось сохранить кадр: {path}")
+                with self._lock:
+                    self.failed += 1
+                COLLECTED_IMAGES_TOTAL.labels(result='failed').inc()
+                continue
+            try:
+                self._write_labels(filename, detections, frame.shape[1], frame.shape[0])
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO images (path, phash, time, camera, classes, reasons) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 (path, f'{phash:016x}', image_time, camera,
+                                  ','.join(sorted({detection[5] for detection in detections})), ','.join(reasons)))
+            except (OSError, sqlite3.Error) as e:
+                print(f"[Image Collector ERROR] Не удалось записать разметку или индекс для {path}: {e}")
+            with self._lock:
+                self.saved += 1
+            COLLECTED_IMAGES_TOTAL.labels(result='saved').inc()
+            print(f"[Image Collector] Кадр сохранен для разметки ({', '.join(reasons)}): {path}")
+
+    def _write_labels(self, filename, detections, frame_width, frame_height):
+        if self._class_ids is None:
+            # Классы модели известны только после ее загрузки; classes.txt нужен инструментам разметки
+            names = self.names()
+            self._class_ids = {name: class_id for class_id, name in names.items()}
+            with open(os.path.join(self.run_folder, 'classes.txt'), 'w', encoding='utf-8') as f:
+                f.write(''.join(f"{names[class_id]}\n" for class_id in sorted(names)))
+        lines = yolo_labels(detections, self._class_ids, frame_width, frame_height)
+        with open(os.path.join(self._labels_folder, filename + '.txt'), 'w', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
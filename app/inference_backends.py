@@ -0,0 +1,217 @@
+# app/inference_backends.py
+
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import imutils
+
+from batch_inference import parse_results
+
+# --- Параметры выбора бэкенда инференса ---
+BACKEND_ACCURACY_TOLERANCE = 0.05 # Допустимое снижение совпадения детекций с PyTorch (0.05 = 5%)
+BACKEND_MATCH_IOU = 0.5           # IoU, при котором детекции одного класса считаются совпавшими
+CALIBRATION_FRAMES = 20           # Сколько кадров калибровочного клипа прогнать через каждый бэкенд
+CALIBRATION_FRAME_WIDTH = 480     # Ширина калибровочных кадров (как в конвейере камеры)
+
+# Бэкенды: параметры экспорта ultralytics, нужные пакеты и суффикс файла экспорта рядом с .pt.
+# Экспорт с динамическими размерами, чтобы работал батч мультикамерного режима.
+BACKENDS = {
+    'torch': None,
+    'onnx': {'export': {'format': 'onnx', 'dynamic': True},
+             'packages': ('onnx', 'onnxruntime'), 'suffix': '.onnx'},
+    'openvino': {'export': {'format': 'openvino', 'dynamic': True},
+                 'packages': ('openvino',), 'suffix': '_openvino_model'},
+    'openvino_int8': {'export': {'format': 'openvino', 'dynamic': True, 'int8': True},
+                      'packages': ('openvino', 'nncf'), 'suffix': '_int8_openvino_model'},
+}
+
+
+def available_backends():
+    """Бэкенды, для которых установлены пакеты (иначе экспорт ultralytics пытается ставить их сам)."""
+    return [name for name, spec in BACKENDS.items()
+            if spec is None or all(importlib.util.find_spec(package) is not None for package in spec['packages'])]
+
+
+def weights_fingerprint(model_path):
+    """SHA-256 файла весов: экспорт пересобирается, только если веса изменились."""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_path(model_path, backend):
+    """Путь экспортированной модели рядом с .pt (там же, куда ее кладет ultralytics)."""
+    return os.path.splitext(model_path)[0] + BACKENDS[backend]['suffix']
+
+
+def export_model(model_path, backend, fingerprint=None, calibration_frames=None):
+    """
+    Возвращает путь экспорта модели для бэкенда, при необходимости экспортируя ее.
+    Рядом с экспортом хранится <путь>.source.json с хешем весов, из которых он собран:
+    если хеш совпадает, экспорт берется из кэша.
+    :param calibration_frames: Кадры для калибровки INT8 (иначе ultralytics скачивает COCO).
+    :return: (путь, True если экспорт пересобран)
+    """
+    from ultralytics import YOLO
+
+    spec = BACKENDS[backend]
+    path = export_path(model_path, backend)
+    source_path = path + '.source.json'
+    fingerprint = fingerprint or weights_fingerprint(model_path)
+    try:
+        with open(source_path, encoding='utf-8') as f:
+            if json.load(f).get('weights_sha256') == fingerprint and os.path.exists(path):
+                return path, False
+    except (OSError, ValueError):
+        pass
+
+    print(f"[Inference Backends] Экспорт {model_path} для бэкенда {backend}...")
+    _remove(path)
+    _remove(source_path)
+    export_kwargs = dict(spec['export'])
+    dataset_dir = None
+    try:
+        model = YOLO(model_path)
+        if export_kwargs.get('int8') and calibration_frames:
+            dataset_dir = _write_calibration_dataset(calibration_frames, model.names)
+            export_kwargs['data'] = os.path.join(dataset_dir, 'data.yaml')
+        exported = str(model.export(**export_kwargs)).rstrip(os.sep)
+    finally:
+        if dataset_dir:
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+    if os.path.abspath(exported) != os.path.abspath(path):
+        os.replace(exported, path)
+    with open(source_path, 'w', encoding='utf-8') as f:
+        json.dump({'weights_sha256': fingerprint, 'backend': backend, 'export': spec['export'],
+                   'created': time.time()}, f)
+    return path, True
+
+
+def load_calibration_frames(source, count=CALIBRATION_FRAMES, width=CALIBRATION_FRAME_WIDTH):
+    """Равномерно выбирает count кадров из видео (калибровочного клипа). Пустой список, если видео не читается."""
+    cap = cv2.VideoCapture(source)
+    frames = []
+    try:
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, total // count) if total > 0 else 1
+        index = 0
+        while len(frames) < count:
+            if step > 1:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(imutils.resize(frame, width=width))
+            index += step
+    finally:
+        cap.release()
+    return frames
+
+
+def detection_agreement(reference, candidate, iou_threshold=BACKEND_MATCH_IOU):
+    """
+    Совпадение детекций бэкенда с эталоном (PyTorch) по всем кадрам: F1 по парам
+    одного класса с IoU не ниже порога. 1.0 - детекции совпали полностью.
+    :param reference: Список детекций эталона для каждого кадра.
+    :param candidate: Список детекций бэкенда для тех же кадров.
+    """
+    matched = total_reference = total_candidate = 0
+    for reference_detections, candidate_detections in zip(reference, candidate):
+        total_reference += len(reference_detections)
+        total_candidate += len(candidate_detections)
+        unmatched = list(candidate_detections)
+        for detection in sorted(reference_detections, key=lambda d: d[4], reverse=True):
+            best, best_iou = None, iou_threshold
+            for other in unmatched:
+                overlap = _iou(detection, other)
+                if other[5] == detection[5] and overlap >= best_iou:
+                    best, best_iou = other, overlap
+            if best is not None:
+                unmatched.remove(best)
+                matched += 1
+    if total_reference + total_candidate == 0:
+        return 1.0
+    return 2.0 * matched / (total_reference + total_candidate)
+
+
+def measure_backend(model, frames, device, conf=0.5):
+    """Прогоняет кадры по одному. Возвращает (детекции по кадрам, средняя задержка в мс) после одного прогревочного прогона."""
+    model(frames[0], conf=conf, verbose=False, device=device)
+    detections = []
+    start_time = time.perf_counter()
+    for frame in frames:
+        results = model(frame, conf=conf, verbose=False, device=device)
+        detections.append(parse_results(results[0], model.names))
+    return detections, (time.perf_counter() - start_time) / len(frames) * 1000
+
+
+def select_backend(model_path, torch_model, frames, candidates, device='cpu',
+                   tolerance=BACKEND_ACCURACY_TOLERANCE, fingerprint=None):
+    """
+    Микро-бенчмарк при запуске: прогоняет калибровочные кадры через PyTorch и каждый бэкенд-кандидат
+    и выбирает самый быстрый, у которого совпадение детекций с PyTorch не ниже 1 - tolerance.
+    Бэкенд, который не удалось экспортировать или загрузить, пропускается.
+    :return: (имя бэкенда, загруженная модель, отчет по бэкендам)
+    """
+    from ultralytics import YOLO
+
+    fingerprint = fingerprint or weights_fingerprint(model_path)
+    reference, torch_latency = measure_backend(torch_model, frames, device)
+    report = {'torch': {'latency_ms': round(torch_latency, 2), 'agreement': 1.0, 'eligible': True}}
+    best_name, best_model, best_latency = 'torch', torch_model, torch_latency
+    for name in candidates:
+        if name == 'torch':
+            continue
+        try:
+            path, _ = export_model(model_path, name, fingerprint, calibration_frames=frames)
+            model = YOLO(path, task='detect')
+            detections, latency = measure_backend(model, frames, 'cpu')
+        except Exception as e:
+            print(f"[Inference Backends ERROR] Бэкенд {name} пропущен: {e}")
+            report[name] = {'error': str(e), 'eligible': False}
+            continue
+        agreement = detection_agreement(reference, detections)
+        eligible = agreement >= 1.0 - tolerance
+        report[name] = {'latency_ms': round(latency, 2), 'agreement': round(agreement, 4), 'eligible': eligible}
+        print(f"[Inference Backends] {name}: {latency:.1f} мс/кадр (PyTorch {torch_latency:.1f}), "
+              f"совпадение с PyTorch {agreement:.3f}{'' if eligible else ' - ниже допуска'}")
+        if eligible and latency < best_latency:
+            best_name, best_model, best_latency = name, model, latency
+    return best_name, best_model, report
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    intersection = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def _write_calibration_dataset(frames, names):
+    """Временный датасет в формате YOLO (только изображения) для калибровки INT8 на кадрах своей камеры."""
+    dataset_dir = tempfile.mkdtemp(prefix='int8_calibration_')
+    images_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(images_dir)
+    for index, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(images_dir, f'{index:04d}.jpg'), frame)
+    with open(os.path.join(dataset_dir, 'data.yaml'), 'w', encoding='utf-8') as f:
+        f.write(f"path: {dataset_dir}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in sorted(names.items()):
+            f.write(f"  {class_id}: {json.dumps(name)}\n")
+    return dataset_dir
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
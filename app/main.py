@@ -1,15 +1,26 @@
+import atexit
+import datetime
 import os
+import sqlite3
 import threading
 import time
-import cv2
-from flask import Flask, Response, render_template
+from flask import Flask, Response, jsonify, render_template, request
 from dotenv import load_dotenv
 
+APP_START_TIME = time.monotonic() # Начало запуска веб-сервера: от него считаются замеры /healthz
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
-# Импортируем модуль detector
-import detector
+# Модуль detector (torch, YOLO) импортируется только в том процессе, где работает детектор
+import metrics
+from detector_process import DetectorProcess
+from event_query import EVENT_STORE_PATH, query_events
+from frame_ring import feed_stream_hub
+from stream_hub import StreamHub
+
+# Замеры запуска веб-сервера (секунды от APP_START_TIME)
+web_startup_timings = {'imports_seconds': round(time.monotonic() - APP_START_TIME, 3)}
 
 # Конфигурация приложения
 WEB_SERVER_URL = os.getenv('WEB_SERVER_URL', 'http://127.0.0.1:5000/') # Получаем URL из .env
@@ -19,6 +30,14 @@ TELEGRAM_FLASK_PORT = os.getenv('TELEGRAM_FLASK_PORT', 5001) # Порт API Tele
 
 # Параметры детектирования
 VIDEO_SOURCE = 'videos/video.mp4'  # Путь к видеофайлу внутри контейнера
+# Список источников для мультикамерного режима (через запятую в .env): видеофайлы,
+# RTSP/HTTP-потоки или номера устройств, например:
+# VIDEO_SOURCES=videos/cam0.mp4,rtsp://192.168.0.10:554/stream1,0
+VIDEO_SOURCES = [source.strip() for source in os.getenv('VIDEO_SOURCES', VIDEO_SOURCE).split(',') if source.strip()]
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', 8))         # Максимальный батч YOLO
+INFERENCE_MAX_WAIT_SECONDS = float(os.getenv('INFERENCE_MAX_WAIT_SECONDS', 0.02)) # Ожидание добора батча
+# Детектор в отдельном процессе: кадры передаются веб-серверу через разделяемую память
+DETECTOR_PROCESS = os.getenv('DETECTOR_PROCESS', '1') == '1'
 MIN_AREA_FOR_MOTION = 1000          # Минимальная площадь для обнаружения движения
 TELEGRAM_PHOTO_INTERVAL = 10        # Интервал отправки фото в Telegram (секунды)
 COLLECT_IMAGES_FOR_TRAINING = False # Активировать режим сбора изображений
@@ -36,13 +55,50 @@ if not os.path.exists(OUTPUT_FOLDER):
 # Передаем TELEGRAM_API_URL и WEB_SERVER_URL
 telegram_api_url_internal = f"http://telegram:{TELEGRAM_FLASK_PORT}/send_task" # URL для обращения к Telegram-боту внутри Docker-сети
 
-detector_thread = threading.Thread(target=detector.start_video_detection,
-                                   args=(VIDEO_SOURCE, MIN_AREA_FOR_MOTION, TELEGRAM_PHOTO_INTERVAL,
-                                         COLLECT_IMAGES_FOR_TRAINING, OUTPUT_FOLDER,
-                                         telegram_api_url_internal, WEB_SERVER_URL), # Передаем WEB_SERVER_URL
-                                   daemon=True)
-detector_thread.start()
-print("[Main App] Поток детектора запущен.")
+if len(VIDEO_SOURCES) > 1:
+    # Мультикамерный режим: общий поток инференса с батчами для всех камер
+    detector_entry_point = 'start_multi_camera_detection'
+    detector_args = (VIDEO_SOURCES, MIN_AREA_FOR_MOTION, TELEGRAM_PHOTO_INTERVAL,
+                     COLLECT_IMAGES_FOR_TRAINING, OUTPUT_FOLDER,
+                     telegram_api_url_internal, WEB_SERVER_URL,
+                     INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_SECONDS)
+else:
+    detector_entry_point = 'start_video_detection'
+    detector_args = (VIDEO_SOURCES[0], MIN_AREA_FOR_MOTION, TELEGRAM_PHOTO_INTERVAL,
+                     COLLECT_IMAGES_FOR_TRAINING, OUTPUT_FOLDER,
+                     telegram_api_url_internal, WEB_SERVER_URL) # Передаем WEB_SERVER_URL
+
+detector = None
+detector_process = None
+stream_hubs = {}
+
+start_detector_time = time.monotonic()
+if DETECTOR_PROCESS:
+    detector_process = DetectorProcess(detector_entry_point, detector_args, len(VIDEO_SOURCES)).start()
+    atexit.register(detector_process.close)
+    # Хабы стрима читают кадры из колец разделяемой памяти без копирования
+    for camera_id, ring in enumerate(detector_process.rings):
+        stream_hubs[camera_id] = StreamHub(frame_valid=ring.is_valid)
+        threading.Thread(target=feed_stream_hub, args=(ring, stream_hubs[camera_id]), daemon=True).start()
+    print("[Main App] Процесс детектора запущен.")
+else:
+    import detector
+    detector.startup_timings['detector_import_seconds'] = round(time.monotonic() - start_detector_time, 3)
+    detector_thread = threading.Thread(target=getattr(detector, detector_entry_point), args=detector_args, daemon=True)
+    detector_thread.start()
+    print("[Main App] Поток детектора запущен.")
+web_startup_timings['detector_start_seconds'] = round(time.monotonic() - start_detector_time, 3)
+
+def detector_request(command, **kwargs):
+    """Запрос состояния детектора: через канал управления процесса или напрямую в том же процессе."""
+    if detector_process is not None:
+        return detector_process.request(command, **kwargs)
+    return detector.handle_request(command, **kwargs)
+
+def detector_alive():
+    if detector_process is not None:
+        return detector_process.is_alive()
+    return detector_thread.is_alive()
 
 # ====================================================================================
 # Flask-роуты для веб-интерфейса
@@ -55,31 +111,126 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    """Видеопоток для отображения в браузере."""
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    """
+    Видеопоток для отображения в браузере.
+    Необязательные параметры запроса: camera (номер камеры), width (ширина в пикселях),
+    quality (качество JPEG 10-95), fps (максимальная частота кадров для клиента),
+    например /video_feed?camera=1&width=320&quality=60&fps=10
+    """
+    camera_id = request.args.get('camera', default=0, type=int)
+    if not 0 <= camera_id < len(VIDEO_SOURCES):
+        return f"Камера {camera_id} не найдена", 404
+    width = request.args.get('width', type=int)
+    quality = request.args.get('quality', type=int)
+    max_fps = request.args.get('fps', type=float)
+    return Response(generate_frames(width, quality, max_fps, camera_id), mimetype='multipart/x-mixed-replace; boundary=frame')
 
-def generate_frames():
+def generate_frames(width=None, quality=None, max_fps=None, camera_id=0):
     """
     Генератор кадров для видеопотока.
-    Получает текущий кадр от детектора и кодирует его в JPEG.
+    Кадры берутся из общего хаба детектора: каждый кадр кодируется в JPEG один раз
+    для каждого варианта (ширина, качество), а клиенты ждут новый кадр без опроса.
     """
-    while True:
-        # Получаем текущий кадр от детектора
-        frame = detector.get_current_frame_for_stream()
-
-        if frame is not None:
-            # Кодируем кадр в JPEG
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if ret:
-                frame_bytes = buffer.tobytes()
-                # Отправляем кадр в формате multipart/x-mixed-replace
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
-                print("[Main App ERROR] Ошибка кодирования кадра в JPEG.")
-        
-        # Небольшая задержка, чтобы не нагружать CPU слишком сильно, если кадры идут очень быстро
-        time.sleep(0.01) # Например, 10 мс
+    hub = stream_hubs[camera_id] if detector_process is not None else detector.get_stream_hub(camera_id)
+    return hub.stream(width=width, quality=quality, max_fps=max_fps)
+
+@app.route('/notifier_status')
+def notifier_status():
+    """Состояние фоновой очереди уведомлений: глубина, потери, задержка отправки."""
+    stats = detector_request('notifier_status')
+    if stats is None:
+        return jsonify({"status": "not_started"}), 503
+    return jsonify(stats)
+
+@app.route('/adaptive_status')
+def adaptive_status():
+    """Текущие решения адаптивного регулятора нагрузки по каждой камере."""
+    status = detector_request('adaptive_status')
+    if status is None:
+        return jsonify({"status": "not_started"}), 503
+    return jsonify(status)
+
+@app.route('/recorder_status')
+def recorder_status():
+    """Состояние записи клипов событий по каждой камере."""
+    status = detector_request('recorder_status')
+    if status is None:
+        return jsonify({"status": "not_started"}), 503
+    return jsonify(status)
+
+@app.route('/collector_status')
+def collector_status():
+    """Сбор кадров для разметки: причины отбора, дубликаты, очередь записи."""
+    status = detector_request('collector_status')
+    if status is None:
+        return jsonify({"status": "not_started"}), 503
+    return jsonify(status)
+
+@app.route('/events')
+def events():
+    """
+    Поиск событий в индексе, новые первыми.
+    Параметры запроса: class (можно несколько или через запятую), start и end (секунды Unix
+    или ISO 8601), camera, limit (до 200), offset,
+    например /events?class=person&start=2024-05-01T00:00:00&limit=20&offset=40
+    """
+    classes = [name.strip() for value in request.args.getlist('class') for name in value.split(',') if name.strip()]
+    try:
+        start_time = parse_event_time(request.args.get('start'))
+        end_time = parse_event_time(request.args.get('end'))
+        limit = request.args.get('limit', default=50, type=int)
+        offset = request.args.get('offset', default=0, type=int)
+        camera = request.args.get('camera', type=int)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        return jsonify(query_events(EVENT_STORE_PATH, classes, start_time, end_time, camera, limit, offset))
+    except sqlite3.Error as e:
+        print(f"[Main App ERROR] Ошибка запроса к индексу событий: {e}")
+        return jsonify({"status": "error", "message": "Индекс событий недоступен"}), 503
+
+def parse_event_time(value):
+    """Время из параметра запроса: секунды Unix или ISO 8601 (локальное время, если без часового пояса)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+@app.route('/healthz')
+def healthz():
+    """
+    Проверка живости: веб-сервер отвечает и процесс (поток) детектора работает.
+    Модель при этом может еще загружаться - см. /readyz. Возвращает замеры запуска.
+    """
+    alive = detector_alive()
+    health = detector_request('health') if alive else None
+    body = {
+        'status': 'ok' if alive else 'detector_down',
+        'uptime_seconds': round(time.monotonic() - APP_START_TIME, 3),
+        'startup': {'web': web_startup_timings, 'detector': health['startup'] if health else None},
+        'model': health['model'] if health else None,
+        'cameras': health['cameras'] if health else None,
+    }
+    return jsonify(body), 200 if alive else 503
+
+@app.route('/readyz')
+def readyz():
+    """Проверка готовности: модель загружена и прогрета, все камеры выдают свежие кадры."""
+    health = detector_request('health') if detector_alive() else None
+    if health is None:
+        return jsonify({'ready': False, 'reasons': ['детектор не отвечает']}), 503
+    return jsonify(health), 200 if health['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики детектора, стрима и уведомлений в текстовом формате Prometheus."""
+    if detector_process is None:
+        return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+    # Метрики стрима считает веб-сервер, остальные - процесс детектора
+    detector_metrics = detector_process.request('metrics', exclude_metrics=metrics.REGISTRY.names()) or ''
+    return Response(metrics.REGISTRY.render() + detector_metrics, mimetype=metrics.CONTENT_TYPE)
 
 # ====================================================================================
 # Запуск Flask-приложения
@@ -0,0 +1,178 @@
+# app/model_loader.py
+
+import os
+import threading
+import time
+
+import numpy as np
+
+import inference_backends
+
+# --- Параметры загрузки модели ---
+MODEL_WARMUP_PASSES = int(os.getenv('MODEL_WARMUP_PASSES', 2)) # Сколько прогонов на пустом кадре выполнить до готовности
+MODEL_WARMUP_SIZE = 640        # Размер стороны кадра для прогрева
+
+
+class ModelLoader:
+    """
+    Ленивая загрузка YOLO в фоновом потоке.
+    torch и ultralytics импортируются только в потоке загрузки, поэтому модуль детектора
+    импортируется быстро, а захват кадров, поиск движения и веб-стрим работают, пока модель грузится.
+    После загрузки модель прогревается warmup_passes прогонами, чтобы первый настоящий кадр
+    не платил за инициализацию CUDA и выделение памяти.
+    Без GPU модель может работать через экспорт в ONNX Runtime или OpenVINO (в том числе INT8):
+    при backend='auto' бэкенд выбирается микро-бенчмарком на калибровочном клипе (см. inference_backends).
+    Объект можно вызывать как модель ultralytics: вызов ждет готовности.
+    """
+
+    def __init__(self, model_path, warmup_passes=MODEL_WARMUP_PASSES, warmup_size=MODEL_WARMUP_SIZE,
+                 backend='auto', calibration_source=None, accuracy_tolerance=inference_backends.BACKEND_ACCURACY_TOLERANCE):
+        """
+        :param model_path: Путь к весам YOLO.
+        :param warmup_passes: Число прогревочных прогонов (0 - без прогрева).
+        :param warmup_size: Размер стороны кадра для прогрева.
+        :param backend: 'auto', 'torch', 'onnx', 'openvino' или 'openvino_int8'.
+        :param calibration_source: Видео для выбора бэкенда и калибровки INT8.
+        :param accuracy_tolerance: Допустимое снижение совпадения детекций с PyTorch для выбора бэкенда.
+        """
+        if backend != 'auto' and backend not in inference_backends.BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд инференса: {backend}")
+        self.model_path = model_path
+        self.warmup_passes = warmup_passes
+        self.warmup_size = warmup_size
+        self.requested_backend = backend
+        self.calibration_source = calibration_source
+        self.accuracy_tolerance = accuracy_tolerance
+        self.model = None
+        self.device = None
+        self.backend = None
+        self.backend_report = None
+        self.state = 'not_started' # not_started -> loading -> warming_up -> ready | failed
+        self.error = None
+        self.timings = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Запускает загрузку в фоне (повторные вызовы ничего не делают)."""
+        with self._lock:
+            if self._thread is None:
+                self.state = 'loading'
+                self._thread = threading.Thread(target=self._load, daemon=True)
+                self._thread.start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        """Ждет окончания загрузки. Возвращает True, если модель готова."""
+        self.start()
+        self._ready.wait(timeout)
+        return self.state == 'ready'
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    @property
+    def names(self):
+        self._require_ready()
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        """Инференс моделью ultralytics на устройстве загрузчика (ждет готовности модели)."""
+        self._require_ready()
+        if kwargs.get('device') is None:
+            kwargs['device'] = self.device
+        return self.model(source, **kwargs)
+
+    def status(self):
+        return {'state': self.state, 'model_path': self.model_path, 'device': self.device,
+                'backend': self.backend, 'requested_backend': self.requested_backend,
+                'backend_report': self.backend_report, 'error': self.error, 'timings': dict(self.timings)}
+
+    def _require_ready(self):
+        if not self.wait_ready():
+            raise RuntimeError(f"Модель YOLO не загружена: {self.error}")
+
+    def _choose_backend(self):
+        """Переключает модель на экспорт ONNX/OpenVINO. При любой ошибке остается PyTorch."""
+        if self.requested_backend == 'auto' and self.device != 'cpu':
+            print(f"[YOLO Detector] Бэкенд: PyTorch ({self.device}).")
+            return
+        frames = []
+        if self.calibration_source:
+            frames = inference_backends.load_calibration_frames(self.calibration_source)
+        from ultralytics import YOLO
+
+        if self.requested_backend == 'auto':
+            candidates = inference_backends.available_backends()
+            if len(candidates) == 1:
+                print("[YOLO Detector] Бэкенд: PyTorch (ONNX Runtime и OpenVINO не установлены).")
+                return
+            if not frames:
+                print(f"[YOLO Detector WARNING] Калибровочный клип {self.calibration_source} недоступен, "
+                      f"точность бэкендов не проверить - используется PyTorch.")
+                return
+            name, model, self.backend_report = inference_backends.select_backend(
+                self.model_path, self.model, frames, candidates, self.device, self.accuracy_tolerance)
+        else:
+            name = self.requested_backend
+            try:
+                path, rebuilt = inference_backends.export_model(self.model_path, name, calibration_frames=frames)
+                model = YOLO(path, task='detect')
+            except Exception as e:
+                print(f"[YOLO Detector ERROR] Бэкенд {name} недоступен, используется PyTorch: {e}")
+                self.backend_report = {name: {'error': str(e)}}
+                return
+            self.backend_report = {name: {'path': path, 'rebuilt': rebuilt}}
+        if name != 'torch':
+            self.model = model
+            self.device = 'cpu'
+            self.backend = name
+        print(f"[YOLO Detector] Бэкенд: {self.backend}.")
+
+    def _load(self):
+        start_time = time.monotonic()
+        try:
+            step_time = time.monotonic()
+            import torch
+            from ultralytics import YOLO
+            self.timings['import_seconds'] = round(time.monotonic() - step_time, 3)
+
+            step_time = time.monotonic()
+            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.timings['device_seconds'] = round(time.monotonic() - step_time, 3)
+            print(f"[YOLO Detector] Используется устройство: {self.device}")
+
+            step_time = time.monotonic()
+            self.model = YOLO(self.model_path)
+            self.timings['load_seconds'] = round(time.monotonic() - step_time, 3)
+            print(f"[YOLO Detector] Модель {self.model_path} загружена за {self.timings['load_seconds']} с.")
+
+            step_time = time.monotonic()
+            self.backend = 'torch'
+            if self.requested_backend != 'torch':
+                self._choose_backend()
+            self.timings['backend_seconds'] = round(time.monotonic() - step_time, 3)
+
+            self.state = 'warming_up'
+            step_time = time.monotonic()
+            blank = np.zeros((self.warmup_size, self.warmup_size, 3), dtype=np.uint8)
+            passes = []
+            for _ in range(self.warmup_passes):
+                pass_time = time.monotonic()
+                self.model(blank, verbose=False, device=self.device)
+                passes.append(round(time.monotonic() - pass_time, 3))
+            self.timings['warmup_seconds'] = round(time.monotonic() - step_time, 3)
+            self.timings['warmup_passes_seconds'] = passes
+            self.state = 'ready'
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            print(f"[YOLO Detector ERROR] Не удалось загрузить модель {self.model_path}: {e}")
+        finally:
+            self.timings['total_seconds'] = round(time.monotonic() - start_time, 3)
+            self._ready.set()
+        if self.state == 'ready':
+            print(f"[YOLO Detector] Модель готова за {self.timings['total_seconds']} с "
+                  f"(прогрев: {self.timings['warmup_passes_seconds']}).")
@@ -0,0 +1,176 @@
+# app/notifier.py
+
+import collections
+import threading
+import time
+
+import cv2
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# --- Параметры очереди уведомлений ---
+OUTBOX_MAX_SIZE = 32           # Максимальное число событий в очереди
+OUTBOX_MAX_RETRIES = 3         # Число повторных попыток отправки
+OUTBOX_BACKOFF_SECONDS = 0.5   # Начальная задержка между попытками (удваивается)
+OUTBOX_MAX_BACKOFF_SECONDS = 10.0
+OUTBOX_REQUEST_TIMEOUT = 5
+
+TELEGRAM_DISPATCH_TOTAL = metrics.Counter('telegram_dispatch_total',
+                                          'Результаты отправки уведомлений Telegram-боту (sent, failed, dropped, retry)',
+                                          ['result'])
+TELEGRAM_SEND_SECONDS = metrics.Histogram('telegram_send_seconds',
+                                          'Время успешной отправки уведомления Telegram-боту, включая повторы')
+TELEGRAM_OUTBOX_DEPTH = metrics.Gauge('telegram_outbox_depth', 'Число событий в очереди уведомлений')
+
+
+class NotificationOutbox:
+    """
+    Фоновая очередь уведомлений для Telegram-бота.
+    Цикл детектора только ставит событие в очередь через enqueue(): запись JPEG на диск
+    и HTTP-запрос выполняются в отдельном потоке через общий requests.Session (keep-alive).
+    При переполнении очереди удаляется самое старое событие.
+    """
+
+    def __init__(self, telegram_api_url, max_size=OUTBOX_MAX_SIZE, max_retries=OUTBOX_MAX_RETRIES,
+                 backoff_seconds=OUTBOX_BACKOFF_SECONDS, timeout=OUTBOX_REQUEST_TIMEOUT):
+        """
+        :param telegram_api_url: URL для отправки задач Telegram-боту.
+        :param max_size: Максимальная глубина очереди.
+        :param max_retries: Число повторных попыток при ошибке сети или 5xx.
+        :param backoff_seconds: Начальная задержка перед повтором.
+        :param timeout: Таймаут HTTP-запроса.
+        """
+        self.telegram_api_url = telegram_api_url
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+        self._events = collections.deque(maxlen=max_size)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_send_latency = None
+        self.total_send_latency = 0.0
+
+        self._sent_metric = TELEGRAM_DISPATCH_TOTAL.labels(result='sent')
+        self._failed_metric = TELEGRAM_DISPATCH_TOTAL.labels(result='failed')
+        self._dropped_metric = TELEGRAM_DISPATCH_TOTAL.labels(result='dropped')
+        self._retry_metric = TELEGRAM_DISPATCH_TOTAL.labels(result='retry')
+        TELEGRAM_OUTBOX_DEPTH.set_function(self.depth)
+
+    def start(self):
+        self._thread.start()
+        print(f"[Notifier] Очередь уведомлений запущена (до {self._events.maxlen} событий).")
+        return self
+
+    def enqueue(self, frame, photo_path, message_text, voice_text, clip_path=None, camera=None):
+        """
+        Ставит событие в очередь. Не блокирует вызывающий поток и не обращается к сети или диску.
+        :param frame: Кадр для сохранения (не должен изменяться после вызова).
+        :param photo_path: Путь, по которому кадр будет сохранен для бота.
+        :param clip_path: Путь клипа события (файл появится после окончания пост-записи).
+        :param camera: Номер камеры: бот объединяет одинаковые уведомления только одной камеры.
+        """
+        event = {
+            'frame': frame,
+            'photo_path': photo_path,
+            'message_text': message_text,
+            'voice_text': voice_text,
+            'clip_path': clip_path,
+            'camera': camera,
+        }
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1 # deque с maxlen сам вытеснит самое старое событие
+                self._dropped_metric.inc()
+            self._events.append(event)
+            self.enqueued += 1
+            self._cond.notify()
+
+    def depth(self):
+        with self._cond:
+            return len(self._events)
+
+    def stats(self):
+        """Возвращает статистику очереди для наблюдения."""
+        with self._cond:
+            delivered = self.sent
+            return {
+                'depth': len(self._events),
+                'max_size': self._events.maxlen,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'last_send_latency': self.last_send_latency,
+                'avg_send_latency': self.total_send_latency / delivered if delivered else None,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._events) > 0)
+                event = self._events.popleft()
+            self._process(event)
+
+    def _process(self, event):
+        if not cv2.imwrite(event['photo_path'], event['frame']):
+            print(f"[Notifier ERROR] Не удалось сохранить снимок: {event['photo_path']}")
+
+        payload = {
+            'photo_path': event['photo_path'],
+            'message_text': event['message_text'],
+            'voice_text': event['voice_text']
+        }
+        if event['clip_path']:
+            payload['clip_path'] = event['clip_path']
+        if event['camera'] is not None:
+            payload['camera'] = event['camera']
+        start_send_time = time.monotonic()
+        if self._post_with_retries(payload):
+            latency = time.monotonic() - start_send_time
+            with self._cond:
+                self.sent += 1
+                self.last_send_latency = latency
+                self.total_send_latency += latency
+            self._sent_metric.inc()
+            TELEGRAM_SEND_SECONDS.observe(latency)
+        else:
+            with self._cond:
+                self.failed += 1
+            self._failed_metric.inc()
+
+    def _post_with_retries(self, payload):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._cond:
+                    self.retries += 1
+                self._retry_metric.inc()
+                time.sleep(min(self.backoff_seconds * 2 ** (attempt - 1), OUTBOX_MAX_BACKOFF_SECONDS))
+            try:
+                response = self._session.post(self.telegram_api_url, json=payload, timeout=self.timeout)
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    print(f"[Notifier] Задача для Telegram успешно отправлена по HTTP ({response.status_code}).")
+                    return True
+                print(f"[Notifier ERROR] Telegram API вернул {response.status_code} (попытка {attempt + 1}).")
+            except requests.exceptions.HTTPError as e:
+                # Ошибки 4xx не исправятся повтором
+                print(f"[Notifier ERROR] Задача отклонена Telegram API: {e}")
+                return False
+            except requests.exceptions.RequestException as e:
+                print(f"[Notifier ERROR] Ошибка при отправке задачи в Telegram API (попытка {attempt + 1}): {e}")
+        return False
@@ -0,0 +1,66 @@
+# app/pipeline.py
+
+import collections
+import threading
+
+
+class LatestQueue:
+    """
+    Ограниченная очередь между стадиями конвейера с политикой "побеждает последний кадр".
+    put() никогда не блокирует: при переполнении самый старый элемент вытесняется,
+    поэтому медленная стадия не задерживает быструю, а задержка остается ограниченной.
+    В режиме lossless (для воспроизведения записей и бенчмарка) put() ждет свободного места.
+    """
+
+    def __init__(self, max_size=1, lossless=False):
+        self._items = collections.deque(maxlen=max(1, int(max_size)))
+        self._cond = threading.Condition()
+        self._closed = False
+        self.lossless = lossless
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self.lossless:
+                self._cond.wait_for(lambda: len(self._items) < self._items.maxlen or self._closed)
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Возвращает самый старый из оставшихся элементов.
+        Возвращает None, если за timeout ничего не пришло или очередь закрыта и пуста.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if self._items:
+                item = self._items.popleft()
+                self._cond.notify_all()
+                return item
+            return None
+
+    def close(self):
+        """
+        Закрывает очередь: оставшиеся элементы еще можно забрать,
+        после чего get() сразу возвращает None. Будит все ожидающие стадии.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def drained(self):
+        """True, если очередь закрыта и все элементы забраны."""
+        with self._cond:
+            return self._closed and not self._items
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
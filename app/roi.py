@@ -0,0 +1,128 @@
+# app/roi.py
+
+import math
+
+from batch_inference import YOLO_IMGSZ
+from tracker import iou
+
+# --- Параметры инференса по областям движения ---
+ROI_MERGE_GAP = 0.05           # Рамки ближе этой доли ширины кадра объединяются
+ROI_PADDING = 0.25             # Отступ вокруг области в долях ее размера
+ROI_MIN_SIZE = 96              # Минимальный размер стороны кропа (в пикселях исходного кадра)
+ROI_MAX_AREA_FRACTION = 0.5    # Если кропы покрывают большую долю кадра, выгоднее YOLO на весь кадр
+ROI_NMS_IOU = 0.5              # Порог подавления дубликатов из пересекающихся кропов
+ROI_IMGSZ_STRIDE = 32          # Шаг сетки YOLO: размер входа кратен ему
+
+
+def merge_boxes(boxes, gap=0):
+    """
+    Объединяет пересекающиеся и близкие рамки (x1, y1, x2, y2), пока есть что объединять.
+    :param gap: Рамки на расстоянии не больше gap пикселей тоже объединяются.
+    """
+    merged = [list(box) for box in boxes]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        while merged:
+            current = merged.pop()
+            index = 0
+            while index < len(merged):
+                other = merged[index]
+                if (current[0] - gap <= other[2] and other[0] - gap <= current[2] and
+                        current[1] - gap <= other[3] and other[1] - gap <= current[3]):
+                    current = [min(current[0], other[0]), min(current[1], other[1]),
+                               max(current[2], other[2]), max(current[3], other[3])]
+                    merged.pop(index)
+                    changed = True
+                else:
+                    index += 1
+            result.append(current)
+        merged = result
+    return [tuple(box) for box in merged]
+
+
+def pad_box(box, frame_width, frame_height, padding=ROI_PADDING, min_size=ROI_MIN_SIZE):
+    """Расширяет рамку на padding и до min_size, не выходя за границы кадра. Возвращает целые координаты."""
+    x1, y1, x2, y2 = box
+    w = max(x2 - x1, 1)
+    h = max(y2 - y1, 1)
+    new_w = min(frame_width, max(w * (1 + 2 * padding), min_size))
+    new_h = min(frame_height, max(h * (1 + 2 * padding), min_size))
+    cx = (x1 + x2) / 2.0
+    cy = (y1 + y2) / 2.0
+    nx1 = int(max(0, min(frame_width - new_w, cx - new_w / 2)))
+    ny1 = int(max(0, min(frame_height - new_h, cy - new_h / 2)))
+    return nx1, ny1, int(min(frame_width, nx1 + new_w)), int(min(frame_height, ny1 + new_h))
+
+
+def plan_crops(motion_boxes, scale, frame_width, frame_height):
+    """
+    Строит области для кропов по рамкам движения.
+    :param motion_boxes: Рамки движения MOG2 (x, y, w, h) в координатах уменьшенного кадра.
+    :param scale: Во сколько раз исходный кадр больше уменьшенного.
+    :param frame_width: Ширина исходного кадра.
+    :param frame_height: Высота исходного кадра.
+    :return: Список областей (x1, y1, x2, y2) в координатах исходного кадра
+             или None, если выгоднее запускать YOLO на весь кадр.
+    """
+    if not motion_boxes:
+        return None
+    boxes = [(x * scale, y * scale, (x + w) * scale, (y + h) * scale) for x, y, w, h in motion_boxes]
+    regions = merge_boxes(boxes, gap=ROI_MERGE_GAP * frame_width)
+    regions = merge_boxes([pad_box(region, frame_width, frame_height) for region in regions])
+    regions = [pad_box(region, frame_width, frame_height, padding=0) for region in regions]
+
+    covered = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+    if covered > ROI_MAX_AREA_FRACTION * frame_width * frame_height:
+        return None
+    return regions
+
+
+def crop_imgsz(regions, stride=ROI_IMGSZ_STRIDE, max_imgsz=YOLO_IMGSZ):
+    """
+    Размер входа YOLO для кропов: наибольшая сторона кропа, округленная вверх до stride и не больше max_imgsz.
+    С размером по умолчанию (640) ultralytics растягивает каждый кроп до 640 и кроп стоит дороже всего кадра.
+    """
+    side = max(max(x2 - x1, y2 - y1) for x1, y1, x2, y2 in regions)
+    return min(max_imgsz, max(stride, math.ceil(side / stride) * stride))
+
+
+def inference_pixels(shapes, imgsz=YOLO_IMGSZ, stride=ROI_IMGSZ_STRIDE):
+    """
+    Оценка числа пикселей входного тензора YOLO после letterbox ultralytics (пропорциональна затратам CPU).
+    Изображения одного размера масштабируются в imgsz по длинной стороне с добивкой до stride,
+    батч изображений разного размера - в квадраты imgsz x imgsz.
+    :param shapes: Размеры (высота, ширина) изображений одного вызова.
+    """
+    if len(set(shapes)) > 1:
+        return len(shapes) * imgsz * imgsz
+    height, width = shapes[0]
+    ratio = min(imgsz / height, imgsz / width)
+    return len(shapes) * (math.ceil(round(height * ratio) / stride) * stride *
+                          math.ceil(round(width * ratio) / stride) * stride)
+
+
+def map_detections(crop_detections, regions, scale):
+    """
+    Переводит детекции из координат кропов в координаты уменьшенного кадра
+    и подавляет дубликаты на стыках кропов.
+    :param crop_detections: Списки детекций (x1, y1, x2, y2, conf, name) для каждого кропа.
+    :param regions: Области кропов (x1, y1, x2, y2) в координатах исходного кадра.
+    :param scale: Во сколько раз исходный кадр больше уменьшенного.
+    """
+    detections = []
+    for (rx1, ry1, _, _), crop in zip(regions, crop_detections):
+        for x1, y1, x2, y2, conf, name in crop:
+            detections.append((int((x1 + rx1) / scale), int((y1 + ry1) / scale),
+                               int((x2 + rx1) / scale), int((y2 + ry1) / scale), conf, name))
+    return suppress_duplicates(detections)
+
+
+def suppress_duplicates(detections, iou_threshold=ROI_NMS_IOU):
+    """Жадное подавление немаксимумов для детекций одного класса."""
+    kept = []
+    for detection in sorted(detections, key=lambda d: d[4], reverse=True):
+        if all(detection[5] != other[5] or iou(detection, other) < iou_threshold for other in kept):
+            kept.append(detection)
+    return kept
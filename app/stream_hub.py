@@ -0,0 +1,168 @@
+# app/stream_hub.py
+
+import threading
+import time
+import weakref
+
+import cv2
+
+import metrics
+
+# --- Ограничения параметров клиента ---
+MIN_STREAM_WIDTH = 64
+MAX_STREAM_WIDTH = 1920
+MIN_JPEG_QUALITY = 10
+MAX_JPEG_QUALITY = 95
+DEFAULT_JPEG_QUALITY = 80
+
+# Сколько кадров вариант может не запрашиваться, прежде чем его кэш будет удален
+STALE_VARIANT_FRAMES = 300
+
+STREAM_ENCODE_SECONDS = metrics.Histogram('stream_encode_seconds',
+                                          'Время кодирования кадра в JPEG для веб-стрима')
+STREAM_CLIENTS = metrics.Gauge('stream_clients', 'Число подключенных клиентов /video_feed')
+
+_hubs = weakref.WeakSet() # Все хабы процесса - для метрики числа клиентов
+STREAM_CLIENTS.set_function(lambda: sum(hub.clients for hub in list(_hubs)))
+
+
+class StreamHub:
+    """
+    Раздает кадры детектора всем клиентам /video_feed.
+    Каждый опубликованный кадр получает порядковый номер (seq) и кодируется в JPEG
+    не более одного раза для каждого варианта (ширина, качество), независимо от числа клиентов.
+    Клиенты ждут новый кадр на условной переменной, а не в цикле со sleep.
+    """
+
+    def __init__(self, frame_valid=None):
+        """
+        :param frame_valid: Функция seq -> bool для кадров, которые могут быть перезаписаны источником
+                            (кольцо в разделяемой памяти): JPEG перезаписанного во время кодирования кадра отбрасывается.
+        """
+        self.frame_valid = frame_valid
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        # (width, quality) -> [seq, jpeg_bytes, lock]
+        self._variants = {}
+        self.clients = 0
+        _hubs.add(self)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def publish(self, frame, seq=None):
+        """
+        Публикует новый кадр. Хаб забирает кадр во владение:
+        вызывающая сторона не должна изменять его после публикации.
+        :param seq: Номер кадра у источника (должен возрастать); None - следующий по порядку.
+        """
+        with self._cond:
+            self._frame = frame
+            self._seq = self._seq + 1 if seq is None else seq
+            stale = [key for key, entry in self._variants.items()
+                     if self._seq - entry[0] > STALE_VARIANT_FRAMES]
+            for key in stale:
+                del self._variants[key]
+            self._cond.notify_all()
+
+    def latest_frame(self):
+        """Возвращает (seq, кадр) последнего опубликованного кадра без копирования."""
+        with self._cond:
+            return self._seq, self._frame
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Блокируется до появления кадра с seq > last_seq или до истечения timeout.
+        Возвращает (seq, кадр); если нового кадра нет, seq == last_seq.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq and self._frame is not None, timeout)
+            if self._seq > last_seq and self._frame is not None:
+                return self._seq, self._frame
+            return last_seq, None
+
+    def get_jpeg(self, seq, frame, width=None, quality=DEFAULT_JPEG_QUALITY):
+        """
+        Возвращает JPEG кадра seq для варианта (width, quality).
+        Кодирование выполняется один раз: остальные клиенты получают закэшированные байты.
+        """
+        key = (width, quality)
+        with self._cond:
+            entry = self._variants.get(key)
+            if entry is None:
+                entry = [0, None, threading.Lock()]
+                self._variants[key] = entry
+
+        with entry[2]:
+            if entry[0] >= seq and entry[1] is not None:
+                return entry[1]
+
+            start_encode_time = time.monotonic()
+            image = frame
+            if width is not None and width < frame.shape[1]:
+                height = int(frame.shape[0] * width / frame.shape[1])
+                image = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+            ret, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            if not ret:
+                print("[Stream Hub ERROR] Ошибка кодирования кадра в JPEG.")
+                return None
+            if self.frame_valid is not None and not self.frame_valid(seq):
+                return None # Источник перезаписал кадр во время кодирования
+
+            STREAM_ENCODE_SECONDS.observe(time.monotonic() - start_encode_time)
+            entry[0] = seq
+            entry[1] = buffer.tobytes()
+            return entry[1]
+
+    def stream(self, width=None, quality=DEFAULT_JPEG_QUALITY, max_fps=None):
+        """
+        Генератор multipart/x-mixed-replace для одного клиента.
+        :param width: Ширина кадра в пикселях (None - исходная ширина).
+        :param quality: Качество JPEG.
+        :param max_fps: Максимальная частота кадров для клиента (None - без ограничения).
+        """
+        width, quality, max_fps = normalize_stream_params(width, quality, max_fps)
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+        last_seq = 0
+        next_send_time = 0.0
+
+        with self._cond:
+            self.clients += 1
+        try:
+            while True:
+                if min_interval:
+                    delay = next_send_time - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                seq, frame = self.wait_for_frame(last_seq)
+                if frame is None:
+                    continue
+
+                frame_bytes = self.get_jpeg(seq, frame, width, quality)
+                last_seq = seq
+                if frame_bytes is None:
+                    continue
+
+                next_send_time = time.monotonic() + min_interval
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            with self._cond:
+                self.clients -= 1
+
+
+def normalize_stream_params(width, quality, max_fps):
+    """Приводит параметры клиента к допустимым диапазонам, чтобы ограничить число вариантов кодирования."""
+    if width is not None:
+        width = max(MIN_STREAM_WIDTH, min(MAX_STREAM_WIDTH, int(width)))
+        width -= width % 16
+    if quality is None:
+        quality = DEFAULT_JPEG_QUALITY
+    quality = max(MIN_JPEG_QUALITY, min(MAX_JPEG_QUALITY, int(quality)))
+    if max_fps is not None and max_fps <= 0:
+        max_fps = None
+    return width, quality, max_fps
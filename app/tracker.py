@@ -0,0 +1,259 @@
+# app/tracker.py
+
+import threading
+
+import numpy as np
+
+# --- Параметры трекера ---
+TRACK_IOU_THRESHOLD = 0.3        # Минимальный IoU для сопоставления детекции с треком
+TRACK_MAX_MISSES = 2             # Сколько запусков YOLO подряд трек может не находиться, прежде чем удаляется
+TRACK_LOST_FRAMES = 5            # Через сколько кадров без движения движущийся трек считается потерянным
+TRACK_MIN_SPEED = 1.0            # Скорость (пикс/кадр), начиная с которой трек считается движущимся
+MOTION_COVERAGE_THRESHOLD = 0.3  # Доля пересечения, при которой блок движения считается покрытым треком
+
+
+def iou(box_a, box_b):
+    """IoU двух рамок (x1, y1, x2, y2)."""
+    inter = _intersection(box_a, box_b)
+    if inter <= 0:
+        return 0.0
+    union = _area(box_a) + _area(box_b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def overlap_ratio(box_a, box_b):
+    """Пересечение, деленное на площадь меньшей рамки (IoMin)."""
+    inter = _intersection(box_a, box_b)
+    if inter <= 0:
+        return 0.0
+    smaller = min(_area(box_a), _area(box_b))
+    return inter / smaller if smaller > 0 else 0.0
+
+
+def _intersection(box_a, box_b):
+    w = min(box_a[2], box_b[2]) - max(box_a[0], box_b[0])
+    h = min(box_a[3], box_b[3]) - max(box_a[1], box_b[1])
+    return w * h if w > 0 and h > 0 else 0.0
+
+
+def _area(box):
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+
+class KalmanBoxFilter:
+    """
+    Фильтр Калмана с моделью постоянной скорости для рамки.
+    Состояние: (cx, cy, w, h, vx, vy, vw, vh), измерение: (cx, cy, w, h).
+    """
+
+    def __init__(self, box):
+        self.x = np.zeros(8)
+        self.x[:4] = _box_to_measurement(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1000.0, 1000.0, 1000.0, 1000.0])
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+        self.Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001, 0.0001])
+        self.R = np.diag([1.0, 1.0, 10.0, 10.0])
+
+    def predict(self):
+        self.x = self.F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.box
+
+    def update(self, box):
+        y = _box_to_measurement(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return (cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2)
+
+    @property
+    def speed(self):
+        return float(np.hypot(self.x[4], self.x[5]))
+
+
+def _box_to_measurement(box):
+    x1, y1, x2, y2 = box[:4]
+    return np.array([(x1 + x2) / 2.0, (y1 + y2) / 2.0, float(x2 - x1), float(y2 - y1)])
+
+
+class Track:
+    """Отслеживаемый объект со стабильным ID и классом, полученным от YOLO."""
+
+    def __init__(self, track_id, detection):
+        x1, y1, x2, y2, conf, name = detection
+        self.track_id = track_id
+        self.name = name
+        self.conf = conf
+        self.filter = KalmanBoxFilter((x1, y1, x2, y2))
+        self.misses = 0
+        self.unsupported_frames = 0
+        self.hits = 1
+
+    @property
+    def box(self):
+        return self.filter.box
+
+    def as_detection(self):
+        """Трек в формате детекции (x1, y1, x2, y2, conf, name)."""
+        x1, y1, x2, y2 = self.box
+        return (int(x1), int(y1), int(x2), int(y2), self.conf, self.name)
+
+
+class IouTracker:
+    """
+    Легковесный трекер нескольких объектов: сопоставление по IoU и фильтр Калмана.
+    Между запусками YOLO треки продолжаются предсказанием фильтра, а блоки движения MOG2
+    используются, чтобы понять, нужен ли новый запуск YOLO:
+    - появился блок движения, не покрытый ни одним треком (новый объект);
+    - движущийся трек потерял поддержку движения (объект остановился, скрылся или ушел);
+    - прошло detect_every_n_frames кадров с последнего запуска при активной сцене.
+    Блоки движения, в которых YOLO ничего не нашел (листва, тени), на detect_every_n_frames кадров
+    считаются проверенными, чтобы не запускать YOLO на них каждый кадр.
+    Потокобезопасен: step вызывается стадией движения, update - стадией инференса.
+    """
+
+    def __init__(self, detect_every_n_frames=10, iou_threshold=TRACK_IOU_THRESHOLD,
+                 max_misses=TRACK_MAX_MISSES, lost_frames=TRACK_LOST_FRAMES):
+        """
+        :param detect_every_n_frames: Максимум кадров между запусками YOLO, пока в сцене есть треки или движение.
+        :param iou_threshold: Минимальный IoU для сопоставления детекции с треком.
+        :param max_misses: Сколько запусков YOLO подряд трек может не находиться.
+        :param lost_frames: Через сколько кадров без движения движущийся трек считается потерянным.
+        """
+        self.detect_every_n_frames = detect_every_n_frames
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.lost_frames = lost_frames
+        self.tracks = []
+        self._next_id = 1
+        self._frames_since_detection = 0
+        self._detection_pending = False
+        self._pending_blobs = []  # Непокрытые блоки движения, отправленные на проверку YOLO
+        self._ignored_blobs = []  # [рамка, сколько кадров еще игнорировать]
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Сбрасывает все треки (например, при смене разрешения обработки)."""
+        with self._lock:
+            self.tracks = []
+            self._frames_since_detection = 0
+            self._detection_pending = False
+            self._pending_blobs = []
+            self._ignored_blobs = []
+
+    def mark_pending(self):
+        """Кадр отправлен на YOLO: до прихода результата новые запросы не нужны."""
+        with self._lock:
+            self._detection_pending = True
+
+    def cancel_pending(self):
+        """Запуск YOLO не состоялся (ошибка инференса)."""
+        with self._lock:
+            self._detection_pending = False
+
+    def step(self, motion_boxes):
+        """
+        Продвигает треки на один кадр и решает, нужен ли запуск YOLO на этом кадре.
+        :param motion_boxes: Рамки движения MOG2 в формате (x, y, w, h).
+        :return: (нужен ли YOLO, причина) - причина: 'new_blob', 'lost', 'periodic' или None.
+        """
+        motion = [(x, y, x + w, y + h) for x, y, w, h in motion_boxes]
+        with self._lock:
+            self._frames_since_detection += 1
+            for track in self.tracks:
+                track.filter.predict()
+            for blob in self._ignored_blobs:
+                blob[1] -= 1
+            self._ignored_blobs = [blob for blob in self._ignored_blobs if blob[1] > 0]
+
+            covering_boxes = [track.box for track in self.tracks] + [blob[0] for blob in self._ignored_blobs]
+            uncovered = [box for box in motion
+                         if not any(overlap_ratio(box, covering) >= MOTION_COVERAGE_THRESHOLD for covering in covering_boxes)]
+
+            lost = False
+            for track in self.tracks:
+                supported = any(overlap_ratio(track.box, box) >= MOTION_COVERAGE_THRESHOLD for box in motion)
+                if supported or track.filter.speed < TRACK_MIN_SPEED:
+                    track.unsupported_frames = 0
+                else:
+                    track.unsupported_frames += 1
+                    if track.unsupported_frames >= self.lost_frames:
+                        lost = True
+
+            if self._detection_pending:
+                return False, None
+            if uncovered:
+                self._pending_blobs = uncovered
+                return True, 'new_blob'
+            if lost:
+                return True, 'lost'
+            if (self.tracks or motion) and self._frames_since_detection >= self.detect_every_n_frames:
+                return True, 'periodic'
+            return False, None
+
+    def update(self, detections):
+        """
+        Обновляет треки результатами YOLO.
+        :param detections: Список детекций (x1, y1, x2, y2, conf, name).
+        :return: Список новых треков, созданных по этим детекциям.
+        """
+        with self._lock:
+            self._frames_since_detection = 0
+            self._detection_pending = False
+
+            for blob in self._pending_blobs:
+                if not any(overlap_ratio(blob, detection) >= MOTION_COVERAGE_THRESHOLD for detection in detections):
+                    self._ignored_blobs.append([blob, self.detect_every_n_frames])
+            self._pending_blobs = []
+
+            pairs = []
+            for track_index, track in enumerate(self.tracks):
+                for detection_index, detection in enumerate(detections):
+                    if detection[5] != track.name:
+                        continue
+                    score = iou(track.box, detection)
+                    if score >= self.iou_threshold:
+                        pairs.append((score, track_index, detection_index))
+            pairs.sort(reverse=True)
+
+            matched_tracks, matched_detections = set(), set()
+            for _, track_index, detection_index in pairs:
+                if track_index in matched_tracks or detection_index in matched_detections:
+                    continue
+                matched_tracks.add(track_index)
+                matched_detections.add(detection_index)
+                track = self.tracks[track_index]
+                detection = detections[detection_index]
+                track.filter.update(detection)
+                track.conf = detection[4]
+                track.misses = 0
+                track.unsupported_frames = 0
+                track.hits += 1
+
+            for track_index, track in enumerate(self.tracks):
+                if track_index not in matched_tracks:
+                    track.misses += 1
+            self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+            new_tracks = []
+            for detection_index, detection in enumerate(detections):
+                if detection_index in matched_detections:
+                    continue
+                track = Track(self._next_id, detection)
+                self._next_id += 1
+                self.tracks.append(track)
+                new_tracks.append(track)
+            return new_tracks
+
+    def active_detections(self):
+        """Текущие треки в формате детекций (x1, y1, x2, y2, conf, name)."""
+        with self._lock:
+            return [track.as_detection() for track in self.tracks]
@@ -0,0 +1,189 @@
+import collections
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+# --- Лимиты Telegram Bot API ---
+GLOBAL_RATE_PER_SECOND = 30.0     # Не больше ~30 сообщений в секунду на бота
+CHAT_RATE_PER_SECOND = 1.0        # Не больше ~1 сообщения в секунду в один чат
+CHAT_BURST = 3                    # Допустимый короткий всплеск в один чат
+MAX_RATE_LIMIT_RETRIES = 5        # Сколько раз повторять вызов после ответа 429
+MEDIA_GROUP_MAX_SIZE = 10         # Telegram принимает в альбоме от 2 до 10 фото
+CAPTION_MAX_LENGTH = 1024         # Максимальная длина подписи к фото
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше capacity накопленных.
+    pause() блокирует выдачу токенов до указанного момента (ответ 429 с retry_after).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, cost=1):
+        """
+        Резервирует cost токенов. Возвращает, сколько секунд нужно подождать до их появления.
+        Токены списываются сразу (баланс может уйти в минус), поэтому параллельные потоки
+        выстраиваются в очередь, а не отправляют все разом.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= cost
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class TelegramRateLimiter:
+    """
+    Ограничитель частоты вызовов Telegram Bot API: общая корзина на бота и по корзине на каждый чат.
+    Вызовы выполняются через call(): он дожидается токенов, а при ответе 429
+    приостанавливает отправку на retry_after секунд и повторяет вызов.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE_PER_SECOND, chat_rate=CHAT_RATE_PER_SECOND,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RATE_LIMIT_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._lock = threading.Lock()
+        self.rate_limited = 0
+        self.waited_seconds = 0.0
+
+    def _chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return bucket
+
+    def acquire(self, chat_id, cost=1):
+        """Ждет, пока и общий лимит, и лимит чата позволят отправить cost сообщений."""
+        wait = max(self._global.reserve(cost), self._chat_bucket(chat_id).reserve(cost))
+        if wait > 0:
+            with self._lock:
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+    def call(self, chat_id, func, cost=1):
+        """
+        Выполняет вызов API с учетом лимитов.
+        :param func: Функция без аргументов, выполняющая запрос (открывает файлы сама, чтобы повтор был возможен).
+        :param cost: Сколько сообщений создает вызов (для альбома - число фото).
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(chat_id, cost)
+            try:
+                return func()
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                with self._lock:
+                    self.rate_limited += 1
+                print(f"[Telegram RateLimit] Превышен лимит Telegram, пауза {retry_after} с (попытка {attempt + 1}).")
+                self._global.pause(retry_after)
+                self._chat_bucket(chat_id).pause(retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {'rate_limited': self.rate_limited, 'waited_seconds': round(self.waited_seconds, 2)}
+
+
+class AlertBuffer:
+    """
+    Ограниченный буфер уведомлений с дедупликацией и объединением всплесков.
+    Новое уведомление с тем же ключом (камера и текст голосового сообщения) заменяет ожидающее,
+    при переполнении вытесняется самое старое, поэтому свежие события не ждут за устаревшими.
+    next_batch() отдает пачку уведомлений, пришедших в пределах окна объединения.
+    """
+
+    def __init__(self, max_size=20, coalesce_window_seconds=2.0, max_batch_size=MEDIA_GROUP_MAX_SIZE):
+        """
+        :param max_size: Максимальное число ожидающих уведомлений.
+        :param coalesce_window_seconds: Сколько ждать после первого уведомления, собирая пачку.
+        :param max_batch_size: Максимальный размер пачки (не больше размера альбома Telegram).
+        """
+        self.max_size = max_size
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.max_batch_size = max(1, min(max_batch_size, MEDIA_GROUP_MAX_SIZE))
+        self._pending = collections.OrderedDict() # ключ -> (время поступления, задача)
+        self._cond = threading.Condition()
+        self.received = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @staticmethod
+    def dedup_key(task):
+        # Текст не содержит камеру: одинаковые события разных камер не должны заменять друг друга
+        return task.get('camera'), task.get('voice_text') or task['message_text']
+
+    def add(self, task):
+        """
+        Добавляет уведомление.
+        :return: 'queued' или 'deduplicated' (заменило ожидающее уведомление с тем же содержанием).
+        """
+        key = self.dedup_key(task)
+        with self._cond:
+            self.received += 1
+            status = 'queued'
+            if key in self._pending:
+                # Сохраняем более свежий снимок и время, а старое событие убираем из очереди
+                del self._pending[key]
+                self.deduplicated += 1
+                status = 'deduplicated'
+            elif len(self._pending) >= self.max_size:
+                _, (_, stale_task) = self._pending.popitem(last=False)
+                self.dropped += 1
+                print(f"[Telegram Dispatcher] Очередь переполнена, удалено старое уведомление: {stale_task['photo_path']}")
+            self._pending[key] = (time.monotonic(), task)
+            self._cond.notify()
+            return status
+
+    def next_batch(self):
+        """Блокируется до появления уведомлений и возвращает пачку задач в порядке поступления."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._pending) > 0)
+            first_time = next(iter(self._pending.values()))[0]
+            deadline = first_time + self.coalesce_window_seconds
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                _, (_, task) = self._pending.popitem(last=False)
+                batch.append(task)
+            self.batches += 1
+            return batch
+
+    def stats(self):
+        with self._cond:
+            return {'pending': len(self._pending), 'max_size': self.max_size, 'received': self.received,
+                    'deduplicated': self.deduplicated, 'dropped': self.dropped, 'batches': self.batches}
+
+
+def combine_captions(message_texts):
+    """Объединяет подписи уведомлений пачки в одну подпись альбома с учетом лимита длины."""
+    header = f"Событий: {len(message_texts)}"
+    lines = [header] + [f"• {text}" for text in message_texts]
+    caption = "\n".join(lines)
+    if len(caption) <= CAPTION_MAX_LENGTH:
+        return caption
+    return caption[:CAPTION_MAX_LENGTH - 1] + "…"
@@ -1,11 +1,16 @@
+import collections
 import telebot
 import os
 import queue
 import threading
 import time
-from gtts import gTTS
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify # Импортируем Flask для API
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMediaPhoto
+
+from dispatcher import AlertBuffer, TelegramRateLimiter, combine_captions
+from tts_cache import TtsCache
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
@@ -14,6 +19,13 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 TELEGRAM_FLASK_PORT = os.getenv('TELEGRAM_FLASK_PORT', 5001) # Новый порт для Flask API бота
+TELEGRAM_WORKERS = int(os.getenv('TELEGRAM_WORKERS', 4)) # Число потоков отправки уведомлений
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', '/shared_data/tts_cache') # Кэш голосовых сообщений
+TTS_CACHE_MAX_MB = float(os.getenv('TTS_CACHE_MAX_MB', 50)) # Максимальный размер кэша голосовых сообщений
+ALERT_QUEUE_MAX_SIZE = int(os.getenv('ALERT_QUEUE_MAX_SIZE', 20)) # Максимум ожидающих уведомлений
+ALERT_COALESCE_SECONDS = float(os.getenv('ALERT_COALESCE_SECONDS', 2.0)) # Окно объединения уведомлений в альбом
+CLIP_WAIT_SECONDS = float(os.getenv('CLIP_WAIT_SECONDS', 90)) # Сколько ждать дописывания клипа события
+CLIP_POLL_SECONDS = 1.0 # Как часто проверять, появился ли файл клипа
 
 # Проверяем, что токен и ID чата установлены
 if not TELEGRAM_BOT_TOKEN:
@@ -26,49 +38,165 @@ if not TELEGRAM_CHAT_ID:
 # Инициализируем бота
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
 
-# Очередь для задач Telegram (фото, текст, голос)
-telegram_task_queue = queue.Queue()
+# Буфер входящих уведомлений: ограничен, с дедупликацией и объединением всплесков в пачки
+alert_buffer = AlertBuffer(max_size=ALERT_QUEUE_MAX_SIZE, coalesce_window_seconds=ALERT_COALESCE_SECONDS)
+
+# Очередь готовых пачек для обработчиков. Она короткая: пока обработчики заняты,
+# уведомления копятся в alert_buffer, где старые вытесняются и объединяются
+telegram_task_queue = queue.Queue(maxsize=max(1, TELEGRAM_WORKERS))
+
+# Все вызовы Telegram API проходят через ограничитель частоты
+rate_limiter = TelegramRateLimiter()
+
+# Клипы событий: файл появляется только после пост-записи, поэтому клипы отправляются отдельно от фото
+clip_queue = queue.Queue()
+scheduled_clips = collections.deque(maxlen=100) # Недавние клипы: объединенные события ссылаются на один файл
+scheduled_clips_lock = threading.Lock()
+
+def schedule_clip(clip_path, caption):
+    """Ставит клип события в очередь отправки (один раз для каждого файла)."""
+    with scheduled_clips_lock:
+        if clip_path in scheduled_clips:
+            return
+        scheduled_clips.append(clip_path)
+    clip_queue.put((clip_path, caption, time.monotonic() + CLIP_WAIT_SECONDS))
+
+def clip_sender():
+    """Ждет, пока детектор допишет клип, и отправляет его в чат."""
+    while True:
+        clip_path, caption, deadline = clip_queue.get()
+        # Детектор переименовывает клип в итоговое имя только после полной записи
+        while not os.path.exists(clip_path) and time.monotonic() < deadline:
+            time.sleep(CLIP_POLL_SECONDS)
+        if not os.path.exists(clip_path):
+            print(f"[Telegram Clip ERROR] Клип не появился за {CLIP_WAIT_SECONDS} с: {clip_path}")
+            continue
+
+        def upload():
+            with open(clip_path, 'rb') as video:
+                return bot.send_video(TELEGRAM_CHAT_ID, video, caption=caption, supports_streaming=True)
+
+        try:
+            rate_limiter.call(TELEGRAM_CHAT_ID, upload)
+            print(f"[Telegram Clip] Клип события отправлен: {clip_path}")
+        except Exception as e:
+            print(f"[Telegram Clip ERROR] Ошибка при отправке клипа {clip_path}: {e}")
+
+# Кэш синтезированной речи: текст озвучивается один раз, дальше переиспользуется файл или file_id
+tts_cache = TtsCache(TTS_CACHE_DIR, max_bytes=int(TTS_CACHE_MAX_MB * 1024 * 1024))
 
-def send_message_with_photo_and_voice(photo_path, message_text, voice_text):
+def send_voice(voice_text):
+    """
+    Отправляет голосовое сообщение, используя кэш.
+    Если такой текст уже отправлялся, повторно передается только file_id Telegram.
+    :param voice_text: Текст для голосового сообщения.
+    """
+    file_id = tts_cache.get_file_id(voice_text)
+    if file_id:
+        try:
+            rate_limiter.call(TELEGRAM_CHAT_ID, lambda: bot.send_voice(TELEGRAM_CHAT_ID, file_id))
+            print(f"[Telegram Voice] Голосовое сообщение отправлено из кэша (file_id): {voice_text}")
+            return
+        except ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            # file_id мог устареть - загружаем файл заново
+            print(f"[Telegram Voice ERROR] file_id не принят ({e}), загружаю файл заново.")
+            tts_cache.forget_file_id(voice_text)
+
+    voice_path = tts_cache.get_path(voice_text)
+
+    def upload():
+        with open(voice_path, 'rb') as voice:
+            return bot.send_voice(TELEGRAM_CHAT_ID, voice)
+
+    message = rate_limiter.call(TELEGRAM_CHAT_ID, upload)
+    if message.voice:
+        tts_cache.remember_file_id(voice_text, message.voice.file_id)
+    print(f"[Telegram Voice] Голосовое сообщение отправлено: {voice_text}")
+
+def send_message_with_photo_and_voice(photo_path, message_text, voice_text, clip_path=None):
     """
     Отправляет сообщение с фото и голосовым сообщением в указанный Telegram-чат.
     :param photo_path: Путь к файлу фотографии.
     :param message_text: Текст сообщения.
     :param voice_text: Текст для голосового сообщения.
+    :param clip_path: Путь к клипу события (отправляется, когда детектор его допишет).
     """
     try:
         # Отправляем фотографию
         if os.path.exists(photo_path):
-            with open(photo_path, 'rb') as photo:
-                bot.send_photo(TELEGRAM_CHAT_ID, photo, caption=message_text)
+            def upload():
+                with open(photo_path, 'rb') as photo:
+                    return bot.send_photo(TELEGRAM_CHAT_ID, photo, caption=message_text)
+
+            rate_limiter.call(TELEGRAM_CHAT_ID, upload)
             print(f"[Telegram] Фото уведомление отправлено: {photo_path}")
             # Удаляем фото после отправки, чтобы не заполнять диск (опционально, если они не нужны для отладки)
             # os.remove(photo_path)
         else:
             print(f"[Telegram ERROR] Файл фото не найден: {photo_path}. Отправляю только сообщение.")
-            bot.send_message(TELEGRAM_CHAT_ID, f"Обнаружено движение, но фото не найдено: {message_text}")
+            rate_limiter.call(TELEGRAM_CHAT_ID, lambda: bot.send_message(
+                TELEGRAM_CHAT_ID, f"Обнаружено движение, но фото не найдено: {message_text}"))
 
-        # Генерируем голосовое сообщение
+        # Голосовое сообщение берется из кэша или синтезируется
         if voice_text:
-            tts = gTTS(text=voice_text, lang='ru')
-            voice_filename = "voice_message.ogg"
-            # Сохраняем голосовое сообщение во временной папке /app/output, так как она монтируется из shared_data
-            voice_path = os.path.join('/app/output', voice_filename) # Сохраняем в output, чтобы было доступно в обоих контейнерах
-            tts.save(voice_path)
-            
-            # Отправляем голосовое сообщение
-            if os.path.exists(voice_path):
-                with open(voice_path, 'rb') as voice:
-                    bot.send_voice(TELEGRAM_CHAT_ID, voice)
-                print(f"[Telegram Voice] Голосовое сообщение отправлено: {voice_text}")
-                # Удаляем голосовое сообщение после отправки (опционально)
-                os.remove(voice_path)
-            else:
-                print(f"[Telegram Voice ERROR] Не удалось создать голосовой файл: {voice_path}")
-        
+            send_voice(voice_text)
+
+        if clip_path:
+            schedule_clip(clip_path, message_text)
+
     except Exception as e:
         print(f"[Telegram ERROR] Ошибка при отправке сообщения в Telegram: {e}")
 
+def send_alert_batch(batch):
+    """
+    Отправляет пачку уведомлений, пришедших в пределах окна объединения.
+    Одно уведомление отправляется как обычно, несколько - одним альбомом с общей подписью
+    и одним голосовым сообщением.
+    :param batch: Список задач {'photo_path', 'message_text', 'voice_text'}.
+    """
+    if len(batch) == 1:
+        task = batch[0]
+        send_message_with_photo_and_voice(task['photo_path'], task['message_text'], task['voice_text'], task.get('clip_path'))
+        return
+
+    try:
+        caption = combine_captions([task['message_text'] for task in batch])
+        photo_paths = [task['photo_path'] for task in batch if os.path.exists(task['photo_path'])]
+
+        if len(photo_paths) >= 2:
+            def upload():
+                files = [open(path, 'rb') for path in photo_paths]
+                try:
+                    media = [InputMediaPhoto(f, caption=caption if index == 0 else None) for index, f in enumerate(files)]
+                    return bot.send_media_group(TELEGRAM_CHAT_ID, media)
+                finally:
+                    for f in files:
+                        f.close()
+
+            rate_limiter.call(TELEGRAM_CHAT_ID, upload, cost=len(photo_paths))
+        elif photo_paths:
+            def upload():
+                with open(photo_paths[0], 'rb') as photo:
+                    return bot.send_photo(TELEGRAM_CHAT_ID, photo, caption=caption)
+
+            rate_limiter.call(TELEGRAM_CHAT_ID, upload)
+        else:
+            rate_limiter.call(TELEGRAM_CHAT_ID, lambda: bot.send_message(TELEGRAM_CHAT_ID, caption))
+        print(f"[Telegram] Объединенное уведомление отправлено: {len(batch)} событий, фото: {len(photo_paths)}")
+
+        # Голосовые тексты без повторов, в порядке поступления
+        voice_texts = list(dict.fromkeys(task['voice_text'] for task in batch if task['voice_text']))
+        if voice_texts:
+            send_voice(" ".join(voice_texts))
+
+        for task in batch:
+            if task.get('clip_path'):
+                schedule_clip(task['clip_path'], task['message_text'])
+    except Exception as e:
+        print(f"[Telegram ERROR] Ошибка при отправке объединенного уведомления в Telegram: {e}")
+
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -82,7 +210,8 @@ telegram_api_app = Flask(__name__)
 def receive_task():
     """
     Принимает задачу от детектора (сервиса app) и добавляет ее в очередь.
-    Ожидает JSON вида: {"photo_path": "...", "message_text": "...", "voice_text": "..."}
+    Ожидает JSON вида: {"photo_path": "...", "message_text": "...", "voice_text": "...", "clip_path": "...", "camera": 0}
+    (clip_path - необязательный путь к клипу события, camera - номер камеры для дедупликации).
     """
     try:
         data = request.get_json()
@@ -96,38 +225,57 @@ def receive_task():
         if not photo_path or not message_text:
             raise ValueError("Missing required fields: photo_path or message_text")
 
-        telegram_task_queue.put({
+        status = alert_buffer.add({
             'photo_path': photo_path,
             'message_text': message_text,
-            'voice_text': voice_text
+            'voice_text': voice_text,
+            'clip_path': data.get('clip_path'),
+            'camera': data.get('camera')
         })
-        print(f"[Telegram API] Задача получена и добавлена в очередь: {photo_path}")
-        return jsonify({"status": "success", "message": "Task added to queue"}), 200
+        print(f"[Telegram API] Задача получена ({status}): {photo_path}")
+        return jsonify({"status": "success", "message": "Task added to queue", "queue": status}), 200
     except Exception as e:
         print(f"[Telegram API ERROR] Ошибка при получении задачи: {e}")
         return jsonify({"status": "error", "message": str(e)}), 400
 
+@telegram_api_app.route('/dispatcher_status')
+def dispatcher_status():
+    """Состояние очереди уведомлений, ограничителя частоты и кэша голосовых сообщений."""
+    return jsonify({
+        'alerts': alert_buffer.stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'tts_cache': tts_cache.stats(),
+    })
+
 # Функция для запуска Flask API в отдельном потоке
 def run_flask_api():
     print(f"[Telegram API] Запуск Flask API на 0.0.0.0:{TELEGRAM_FLASK_PORT}")
     telegram_api_app.run(host='0.0.0.0', port=int(TELEGRAM_FLASK_PORT), debug=False, use_reloader=False)
 
+# Диспетчер: собирает уведомления из буфера в пачки и передает обработчикам
+def telegram_dispatcher():
+    """
+    Забирает из буфера пачки уведомлений, пришедших в пределах окна объединения.
+    Блокируется, пока все обработчики заняты, чтобы ожидающие уведомления оставались в буфере.
+    """
+    while True:
+        batch = alert_buffer.next_batch()
+        telegram_task_queue.put(batch)
+
 # Запуск обработки задач из очереди Telegram-бота
 def telegram_queue_processor():
     """
-    Постоянно проверяет очередь задач и отправляет сообщения в Telegram.
+    Поток-обработчик: блокируется на очереди пачек и отправляет сообщения в Telegram.
+    Запускается в нескольких экземплярах, чтобы синтез речи и загрузка файлов шли параллельно;
+    частоту самих вызовов API ограничивает rate_limiter.
     """
     while True:
-        if not telegram_task_queue.empty():
-            task = telegram_task_queue.get()
-            print(f"[Telegram Processor] Обработка задачи из очереди: {task['photo_path']}")
-            send_message_with_photo_and_voice(
-                task['photo_path'],
-                task['message_text'],
-                task['voice_text']
-            )
+        batch = telegram_task_queue.get()
+        try:
+            print(f"[Telegram Processor] Обработка пачки из очереди: {len(batch)} событий")
+            send_alert_batch(batch)
+        finally:
             telegram_task_queue.task_done()
-        time.sleep(0.1)
 
 # Главная точка входа для Telegram-бота
 if __name__ == '__main__':
@@ -135,9 +283,15 @@ if __name__ == '__main__':
     flask_thread = threading.Thread(target=run_flask_api, daemon=True)
     flask_thread.start()
 
-    # Запускаем обработчик очереди Telegram в отдельном потоке
-    processor_thread = threading.Thread(target=telegram_queue_processor, daemon=True)
-    processor_thread.start()
+    # Запускаем диспетчер и пул обработчиков очереди Telegram
+    dispatcher_thread = threading.Thread(target=telegram_dispatcher, daemon=True)
+    dispatcher_thread.start()
+    clip_thread = threading.Thread(target=clip_sender, daemon=True)
+    clip_thread.start()
+    for index in range(max(1, TELEGRAM_WORKERS)):
+        processor_thread = threading.Thread(target=telegram_queue_processor, name=f"telegram-worker-{index}", daemon=True)
+        processor_thread.start()
+    print(f"[Telegram Main] Запущено обработчиков очереди: {max(1, TELEGRAM_WORKERS)}")
     print("[Telegram Main] Telegram-бот и API запущены. Ожидают задач и сообщений.")
 
     # Запускаем polling для получения сообщений от Telegram API (например, команды /start)
@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from gtts import gTTS
+
+
+class TtsCache:
+    """
+    Кэш синтезированных голосовых сообщений с адресацией по содержимому.
+    Ключ - хэш языка и текста, файл хранится на диске как <ключ>.ogg.
+    Размер кэша ограничен: при превышении удаляются давно не использованные файлы (LRU).
+    После первой отправки запоминается file_id Telegram, и повторно файл уже не загружается.
+    """
+
+    INDEX_FILENAME = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 * 1024, lang='ru'):
+        """
+        :param cache_dir: Папка для файлов кэша.
+        :param max_bytes: Максимальный суммарный размер файлов кэша.
+        :param lang: Язык синтеза речи.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lang = lang
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = collections.OrderedDict() # ключ -> размер файла, порядок - от давних к свежим
+        self._file_ids = {}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.lang}:{text}".encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.ogg")
+
+    def get_file_id(self, text):
+        """Возвращает file_id Telegram для текста, если файл уже отправлялся."""
+        key = self.key(text)
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None and key in self._entries:
+                self._entries.move_to_end(key)
+            return file_id
+
+    def remember_file_id(self, text, file_id):
+        key = self.key(text)
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._save_index()
+
+    def forget_file_id(self, text):
+        """Убирает file_id, который Telegram больше не принимает."""
+        key = self.key(text)
+        with self._lock:
+            if self._file_ids.pop(key, None) is not None:
+                self._save_index()
+
+    def get_path(self, text):
+        """
+        Возвращает путь к аудиофайлу для текста, синтезируя его при промахе.
+        Синтез выполняется во временный файл с уникальным именем и атомарно переносится в кэш,
+        поэтому параллельные обработчики не мешают друг другу.
+        """
+        key = self.key(text)
+        path = self.path_for(key)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries and os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    os.utime(path) # Время доступа нужно, чтобы восстановить порядок LRU после перезапуска
+                    return path
+                self.misses += 1
+
+            fd, temp_path = tempfile.mkstemp(suffix='.ogg', dir=self.cache_dir)
+            os.close(fd)
+            try:
+                gTTS(text=text, lang=self.lang).save(temp_path)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+            with self._lock:
+                size = os.path.getsize(path)
+                self._total_bytes += size - self._entries.pop(key, 0)
+                self._entries[key] = size
+                self._evict()
+                self._save_index()
+            return path
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes,
+                    'file_ids': len(self._file_ids), 'hits': self.hits, 'misses': self.misses}
+
+    def _evict(self):
+        # Последний добавленный файл не удаляется, даже если он один больше лимита
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._file_ids.pop(key, None)
+            try:
+                os.remove(self.path_for(key))
+            except OSError as e:
+                print(f"[TTS Cache ERROR] Не удалось удалить файл кэша {key}: {e}")
+
+    def _load(self):
+        """Восстанавливает кэш с диска: файлы упорядочиваются по времени последнего доступа."""
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILENAME)
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                self._file_ids = json.load(f).get('file_ids', {})
+        except (OSError, ValueError):
+            self._file_ids = {}
+
+        files = []
+        for filename in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(filename)
+            if ext != '.ogg' or len(key) != 64:
+                continue # Незавершенные временные файлы и посторонние файлы пропускаем
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            files.append((max(stat.st_atime, stat.st_mtime), key, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._file_ids = {key: file_id for key, file_id in self._file_ids.items() if key in self._entries}
+        self._evict()
+        print(f"[TTS Cache] Загружено файлов: {len(self._entries)} ({self._total_bytes} байт), file_id: {len(self._file_ids)}")
+
+    def _save_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILENAME)
+        temp_path = f"{index_path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'file_ids': self._file_ids}, f)
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            print(f"[TTS Cache ERROR] Не удалось сохранить индекс кэша: {e}")